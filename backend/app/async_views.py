@@ -0,0 +1,89 @@
+import math
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.request import Request
+
+from .authentication import SignedTokenAuthentication
+from .counters import record_view
+
+from .models import Product
+from .pagination import ProductCursorPagination
+from .read_serializers import ProductListReadSerializer
+from .serializers import ProductSerializer, ConversationSerializer, requested_fields
+from .throttling import SlidingWindowThrottle
+from .views import filter_products, filter_conversations
+
+# Асинхронные версии самых нагруженных GET-запросов. Пока ORM ждёт базу или медленный клиент
+# читает ответ, процесс обслуживает другие запросы, а не держит воркер на каждое соединение.
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, safe=False,
+                        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+def check_throttle(request, view_class):
+    # Те же лимиты, что у DRF-представления (throttle_scope), до любой работы с базой
+    throttle = SlidingWindowThrottle()
+    if not throttle.allow_request(Request(request, authenticators=[SignedTokenAuthentication()]), view_class):
+        raise Throttled(throttle.wait())
+
+
+def request_user(request):
+    # Пользователь из токена (без запроса к базе) или None для анонимного запроса
+    result = SignedTokenAuthentication().authenticate(request)
+    return result[0] if result else None
+
+
+def get_async(async_view, sync_view):
+    # GET обслуживается асинхронно, остальные методы — прежним DRF-представлением
+    view_class = sync_view.view_class
+    sync_view = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET':
+            try:
+                await sync_to_async(check_throttle)(request, view_class)
+                return await async_view(request, *args, **kwargs)
+            except APIException as exc:
+                response = json_response({'detail': exc.detail}, status=exc.status_code)
+                if getattr(exc, 'wait', None):
+                    response['Retry-After'] = str(math.ceil(exc.wait))
+                return response
+        return await sync_view(request, *args, **kwargs)
+
+    # Как и у DRF-представлений; декоратор csrf_exempt в Django 4.2 не поддерживает async-функции
+    view.csrf_exempt = True
+    return view
+
+
+async def product_list(request):
+    # Поиск обращается к базе при построении запроса, поэтому фильтрация идёт в потоке
+    reader = ProductListReadSerializer({'request': request}, fields=requested_fields(request))
+    queryset = reader.prepare(await sync_to_async(filter_products)(request.GET, request_user(request)))
+
+    paginator = ProductCursorPagination()
+    page = await sync_to_async(paginator.paginate_queryset)(queryset, Request(request))
+    if page is not None:
+        return json_response(paginator.get_paginated_data(await sync_to_async(reader.serialize)(page)))
+
+    rows = [row async for row in queryset]
+    return json_response(await sync_to_async(reader.serialize)(rows))
+
+
+async def product_detail(request, pk):
+    try:
+        product = await Product.objects.with_details(requested_fields(request)) \
+            .with_favorited(request_user(request)).aget(pk=pk)
+    except Product.DoesNotExist:
+        return json_response({'detail': 'No Product matches the given query.'}, status=404)
+    record_view(product.pk)
+    return json_response(ProductSerializer(product, context={'request': request}).data)
+
+
+async def conversation_list(request):
+    queryset = filter_conversations(request.GET, requested_fields(request))
+    conversations = [conversation async for conversation in queryset]
+    return json_response(ConversationSerializer(conversations, many=True, context={'request': request}).data)
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.core import signing
+from django.utils.crypto import constant_time_compare
+from rest_framework import authentication, exceptions
+
+from .models import User
+
+TOKEN_SALT = 'app.authentication'
+
+
+class TokenUser:
+    # Пользователь из подписанного токена: известен только id, запроса к базе нет
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id):
+        self.id = self.pk = user_id
+
+
+def issue_token(user):
+    return signing.dumps({'user_id': user.pk}, salt=TOKEN_SALT, compress=True)
+
+
+def read_token(token):
+    # id пользователя или None, если подпись неверна или токен старше AUTH_TOKEN_MAX_AGE
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=settings.AUTH_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return payload.get('user_id')
+
+
+def is_password_hashed(password):
+    try:
+        identify_hasher(password)
+    except ValueError:
+        return False
+    return True
+
+
+def verify_password(user, raw_password):
+    # Пароль в открытом виде (старые записи) или хэш с устаревшими параметрами перехэшируется при входе
+    def upgrade(raw):
+        user.password = make_password(raw)
+        User.objects.filter(pk=user.pk).update(password=user.password)
+
+    if not raw_password or not user.password:
+        return False
+    if not is_password_hashed(user.password):
+        if not constant_time_compare(raw_password, user.password):
+            return False
+        upgrade(raw_password)
+        return True
+    return check_password(raw_password, user.password, setter=upgrade)
+
+
+class SignedTokenAuthentication(authentication.BaseAuthentication):
+    # Authorization: Bearer <токен из /api/auth/login/>
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        header = authentication.get_authorization_header(request).split()
+        if not header or header[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(header) != 2:
+            raise exceptions.AuthenticationFailed('Некорректный заголовок Authorization')
+
+        user_id = read_token(header[1].decode())
+        if user_id is None:
+            raise exceptions.AuthenticationFailed('Токен недействителен или истёк')
+        return TokenUser(user_id), header[1].decode()
+
+    def authenticate_header(self, request):
+        return self.keyword
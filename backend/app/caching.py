@@ -0,0 +1,49 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+
+from .models import Category, SubCategory, Region, District
+
+# Какие справочники от каких моделей зависят: изменение модели сбрасывает только свои ответы
+REFERENCE_CACHE_MODELS = {
+    'categories': (Category, SubCategory),
+    'subcategories': (SubCategory,),
+    'regions': (Region, District),
+    'districts': (District,),
+}
+
+
+def reference_cache_key(name):
+    return f'reference:{name}'
+
+
+def invalidate_reference_cache(model):
+    keys = [reference_cache_key(name) for name, models in REFERENCE_CACHE_MODELS.items() if model in models]
+    cache.delete_many(keys)
+
+
+class CachedListMixin:
+    # Для справочников: готовый JSON хранится в кэше вместе с ETag,
+    # повторный запрос с If-None-Match получает 304 без обращения к базе
+    cache_name = None
+
+    def list(self, request, *args, **kwargs):
+        key = reference_cache_key(self.cache_name)
+        cached = cache.get(key)
+        if cached is None:
+            serializer = self.get_serializer(self.filter_queryset(self.get_queryset()), many=True)
+            body = JSONRenderer().render(serializer.data)
+            cached = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+            cache.set(key, cached, getattr(settings, 'REFERENCE_CACHE_TIMEOUT', 60 * 60 * 24))
+
+        body, etag = cached
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
@@ -0,0 +1,60 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .authentication import read_token
+from .models import Conversation
+
+
+def conversation_group_name(conversation_id):
+    return f'conversation_{conversation_id}'
+
+
+class ConversationConsumer(AsyncJsonWebsocketConsumer):
+    # Клиент подключается к ws/conversations/<pk>/?token=<токен из /api/auth/login/> и получает новые сообщения беседы,
+    # а также события "печатает" и "в сети" от других участников
+
+    async def connect(self):
+        self.conversation_id = self.scope['url_route']['kwargs']['pk']
+        self.user_id = self.get_user_id()
+        self.group_name = conversation_group_name(self.conversation_id)
+
+        if self.user_id is None or not await self.is_participant():
+            await self.close(code=4403)
+            return
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await self.broadcast({'type': 'presence', 'user_id': self.user_id, 'online': True})
+
+    async def disconnect(self, code):
+        if getattr(self, 'group_name', None) and self.user_id is not None:
+            await self.broadcast({'type': 'presence', 'user_id': self.user_id, 'online': False})
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        if content.get('type') == 'typing':
+            await self.broadcast({'type': 'typing', 'user_id': self.user_id})
+
+    async def broadcast(self, event):
+        await self.channel_layer.group_send(self.group_name, {'type': 'conversation.event', 'event': event,
+                                                              'sender_channel': self.channel_name})
+
+    async def conversation_event(self, message):
+        # Свои события "печатает" и "в сети" клиенту не отправляем
+        if message.get('sender_channel') != self.channel_name:
+            await self.send_json(message['event'])
+
+    async def conversation_message(self, message):
+        await self.send_json({'type': 'message', 'message': message['message']})
+
+    def get_user_id(self):
+        # Браузерный WebSocket не умеет передавать заголовок Authorization, поэтому токен приходит в query string
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        token = query.get('token', [None])[0]
+        return read_token(token) if token else None
+
+    @database_sync_to_async
+    def is_participant(self):
+        return Conversation.objects.filter(pk=self.conversation_id, participants__id=self.user_id).exists()
@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ('favorites_count', 'views_count')
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='counters')
+
+
+class CounterBuffer:
+    # Write-behind для счётчиков Product: приращения копятся в памяти процесса и записываются пачкой
+    # (один UPDATE на поле и величину приращения) по размеру буфера или по времени. Приращения
+    # складываются, поэтому у каждого воркера свой буфер; расхождения исправляет reconcile_product_counters
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = defaultdict(int)  # {(поле, id товара): приращение}
+        self.last_flush = time.monotonic()
+        self.flushing = False
+
+    def add(self, product_id, field, delta=1):
+        with self.lock:
+            self.pending[field, product_id] += delta
+            due = not self.flushing and (
+                len(self.pending) >= settings.COUNTER_FLUSH_SIZE
+                or time.monotonic() - self.last_flush >= settings.COUNTER_FLUSH_INTERVAL
+            )
+            if due:
+                self.flushing = True
+        if due:
+            _executor.submit(self.flush_in_background)
+
+    def take(self):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(int)
+            self.last_flush = time.monotonic()
+            return pending
+
+    def restore(self, pending):
+        with self.lock:
+            for key, delta in pending.items():
+                self.pending[key] += delta
+
+    def clear(self):
+        self.take()
+
+    def flush(self):
+        pending = self.take()
+        batches = defaultdict(list)
+        for (field, product_id), delta in pending.items():
+            if delta:
+                batches[field, delta].append(product_id)
+        if not batches:
+            return 0
+        try:
+            with transaction.atomic():
+                for (field, delta), product_ids in batches.items():
+                    Product.objects.filter(pk__in=product_ids).update(**{field: F(field) + delta})
+        except Exception:
+            # База недоступна — приращения вернутся в буфер до следующей записи
+            self.restore(pending)
+            raise
+        return len(pending)
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Не удалось записать счётчики товаров')
+        finally:
+            self.flushing = False
+            close_old_connections()
+
+
+counter_buffer = CounterBuffer()
+
+
+def record_view(product_id):
+    counter_buffer.add(product_id, 'views_count')
+
+
+def record_favorites(product_ids, delta):
+    # Вызывается после коммита, чтобы откат транзакции не менял счётчик
+    for product_id in product_ids:
+        counter_buffer.add(product_id, 'favorites_count', delta)
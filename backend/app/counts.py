@@ -0,0 +1,81 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Product
+
+# Параметры ленты, от которых зависит число товаров (сортировка и курсор на него не влияют)
+COUNT_FILTERS = ('title', 'condition', 'sub_category', 'price_min', 'price_max', 'region', 'district',
+                 'near_district', 'radius', 'owner_id', 'is_active')
+GENERATION_KEY = 'product-count:generation'
+
+
+def generation():
+    # Любая запись в товары меняет поколение, и все закэшированные количества становятся неактуальными
+    return cache.get_or_set(GENERATION_KEY, 1, None)
+
+
+def invalidate_product_counts():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def count_key(params):
+    normalized = sorted((name, params.get(name).strip()) for name in COUNT_FILTERS if params.get(name, '').strip())
+    digest = hashlib.sha1(json.dumps(normalized, ensure_ascii=False).encode()).hexdigest()
+    return f'product-count:{generation()}:{digest}'
+
+
+def product_count(queryset, params, approximate=False):
+    # Возвращает (количество, приблизительное ли оно)
+    if approximate:
+        estimate = estimate_product_count(params)
+        if estimate is not None:
+            return estimate, True
+
+    key = count_key(params)
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'PRODUCT_COUNT_TIMEOUT', 60))
+    return count, False
+
+
+def estimate_product_count(params):
+    # Оценка по статистике планировщика — только для ленты без фильтров или с одним is_active
+    if any(params.get(name) for name in COUNT_FILTERS if name != 'is_active'):
+        return None
+    is_active = params.get('is_active')
+    if is_active not in (None, '', 'true', 'false'):
+        return None
+
+    total = estimated_rows(Product._meta.db_table, 'product_date_idx')
+    if not is_active or total is None:
+        return total
+    # Частичный индекс product_active_date_idx содержит ровно активные товары
+    active = estimated_rows(None, 'product_active_date_idx')
+    if active is None:
+        return None
+    return active if is_active == 'true' else max(total - active, 0)
+
+
+def estimated_rows(table, index):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table or index])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            # sqlite_stat1 заполняется командой ANALYZE: первое число — количество строк в индексе
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE idx = %s', [index])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
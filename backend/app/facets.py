@@ -0,0 +1,158 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, Sum, Value, When
+
+from .models import Product, ProductFacetCount
+
+# Фасет: параметры ленты, которые он заменяет. Количества фасета считаются по всем остальным
+# фильтрам, чтобы рядом с выбранным значением были видны и альтернативы
+FACET_FILTERS = {
+    'sub_category': ('sub_category',),
+    'condition': ('condition',),
+    'region': ('region',),
+    'price': ('price_min', 'price_max'),
+}
+FACET_COLUMNS = {'sub_category': 'sub_category_id', 'condition': 'condition', 'region': 'region_id'}
+# Фасеты, значения которых — id связанных моделей
+ID_FACETS = ('sub_category', 'region')
+# Поля товара, от которых зависят его фасеты
+FACET_FIELDS = ('sub_category_id', 'condition', 'region_id', 'cost', 'is_active')
+
+
+def price_buckets():
+    # [(нижняя граница, верхняя граница или None)] из settings.PRODUCT_PRICE_BUCKETS
+    bounds = list(settings.PRODUCT_PRICE_BUCKETS)
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def bucket_label(low, high):
+    return f'{low}-{high}' if high is not None else f'{low}+'
+
+
+def price_bucket(cost):
+    for low, high in price_buckets():
+        if cost >= low and (high is None or cost < high):
+            return bucket_label(low, high)
+    return None
+
+
+def facet_values(row):
+    # Множество ключей счётчиков (фасет, значение, is_active), в которые входит товар
+    values = {
+        'sub_category': row['sub_category_id'],
+        'condition': row['condition'],
+        'region': row['region_id'],
+        'price': price_bucket(row['cost']),
+    }
+    return {(facet, str(value), row['is_active']) for facet, value in values.items() if value not in (None, '')}
+
+
+def product_facet_values(product):
+    return facet_values({field: getattr(product, field) for field in FACET_FIELDS})
+
+
+def stored_facet_values(product_id):
+    row = Product.objects.filter(pk=product_id).values(*FACET_FIELDS).first()
+    return facet_values(row) if row else set()
+
+
+def update_facet_counts(before, after):
+    # Меняются только счётчики значений, которые товар покинул или в которые попал
+    for key in before - after:
+        add_to_counter(key, -1)
+    for key in after - before:
+        add_to_counter(key, 1)
+
+
+def add_to_counter(key, delta):
+    facet, value, is_active = key
+    counters = ProductFacetCount.objects.filter(facet=facet, value=value, is_active=is_active)
+    if counters.update(count=F('count') + delta):
+        return
+    _, created = ProductFacetCount.objects.get_or_create(
+        facet=facet, value=value, is_active=is_active, defaults={'count': delta},
+    )
+    if not created:
+        counters.update(count=F('count') + delta)
+
+
+def facet_moves(products, facet, value):
+    # Приращения счётчиков при переводе товаров products в значение value фасета:
+    # одна агрегация по их текущим значениям вместо полного пересчёта
+    column = FACET_COLUMNS[facet]
+    deltas = Counter()
+    for row in products.order_by().values(column, 'is_active').annotate(moved=Count('id')):
+        if row[column] not in (None, ''):
+            deltas[(facet, str(row[column]), row['is_active'])] -= row['moved']
+        if value not in (None, ''):
+            deltas[(facet, str(value), row['is_active'])] += row['moved']
+    return deltas
+
+
+def apply_facet_deltas(deltas):
+    for key, delta in deltas.items():
+        if delta:
+            add_to_counter(key, delta)
+
+
+def facet_expression(facet):
+    if facet != 'price':
+        return F(FACET_COLUMNS[facet])
+    return Case(
+        *[
+            When(cost__gte=low, **({'cost__lt': high} if high is not None else {}), then=Value(bucket_label(low, high)))
+            for low, high in price_buckets()
+        ],
+        default=Value(None),
+        output_field=CharField(),
+    )
+
+
+def aggregate_facet(queryset, facet, by_active=False):
+    # Один GROUP BY по значению фасета: {значение: количество} или {(значение, is_active): количество}
+    group = ('facet_value', 'is_active') if by_active else ('facet_value',)
+    rows = queryset.order_by().annotate(facet_value=facet_expression(facet)).values(*group) \
+        .annotate(facet_count=Count('id'))
+    return {
+        tuple(row[name] for name in group) if by_active else row['facet_value']: row['facet_count']
+        for row in rows if row['facet_value'] not in (None, '')
+    }
+
+
+def counted_facet(facet, is_active=None):
+    # Количества из счётчиков — для ленты без фильтров (кроме is_active)
+    counters = ProductFacetCount.objects.filter(facet=facet, count__gt=0)
+    if is_active in ('true', 'false'):
+        counters = counters.filter(is_active=is_active == 'true')
+    rows = counters.values('value').annotate(total=Sum('count'))
+    return {row['value']: row['total'] for row in rows}
+
+
+def facet_items(facet, counts):
+    if facet == 'price':
+        return [
+            {'value': bucket_label(low, high), 'min': low, 'max': high, 'count': counts[bucket_label(low, high)]}
+            for low, high in price_buckets() if counts.get(bucket_label(low, high))
+        ]
+    items = [
+        {'value': int(value) if facet in ID_FACETS else value, 'count': count}
+        for value, count in counts.items() if count
+    ]
+    return sorted(items, key=lambda item: -item['count'])
+
+
+def rebuild_facet_counts(facets=None, products=None, counters=None):
+    # Полный пересчёт счётчиков (после массовых QuerySet.update() или смены PRODUCT_PRICE_BUCKETS).
+    # products и counters передаются из миграции, где нужны исторические модели
+    products = Product.objects.all() if products is None else products
+    counters = ProductFacetCount.objects.all() if counters is None else counters
+    facets = facets or list(FACET_FILTERS)
+    with transaction.atomic():
+        counters.filter(facet__in=facets).delete()
+        counters.bulk_create([
+            counters.model(facet=facet, value=str(value), is_active=is_active, count=count)
+            for facet in facets
+            for (value, is_active), count in aggregate_facet(products, facet, by_active=True).items()
+        ])
@@ -0,0 +1,111 @@
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import District, DistrictDistance
+
+# Лента «рядом» без GIS: у района есть координаты центра и ячейка сетки GEO_CELL_DEGREES x GEO_CELL_DEGREES.
+# Расстояния между районами считаются заранее в DistrictDistance, кандидаты ищутся только в соседних ячейках
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.2
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def has_centroid(district):
+    return district.latitude is not None and district.longitude is not None
+
+
+def geo_cell(latitude, longitude):
+    size = settings.GEO_CELL_DEGREES
+    return math.floor(latitude / size), math.floor(longitude / size)
+
+
+def cell_span(latitude):
+    # Сколько ячеек по широте и долготе покрывает радиус NEARBY_MAX_DISTANCE_KM
+    size = settings.GEO_CELL_DEGREES
+    radius = settings.NEARBY_MAX_DISTANCE_KM
+    lat_cells = math.ceil(radius / KM_PER_DEGREE / size)
+    widest = min(abs(latitude) + lat_cells * size, 89.0)
+    lon_cells = math.ceil(radius / (KM_PER_DEGREE * math.cos(math.radians(widest))) / size)
+    return lat_cells, lon_cells
+
+
+def distance_to(district, other):
+    # Расстояние в км или None, если районы слишком далеко друг от друга.
+    # Для районов без координат остаётся иерархия: тот же регион считается на NEARBY_REGION_DISTANCE_KM
+    if other.pk == district.pk:
+        return 0.0
+    if has_centroid(district) and has_centroid(other):
+        distance = haversine_km(district.latitude, district.longitude, other.latitude, other.longitude)
+        return distance if distance <= settings.NEARBY_MAX_DISTANCE_KM else None
+    if other.region_id == district.region_id:
+        return float(settings.NEARBY_REGION_DISTANCE_KM)
+    return None
+
+
+def distance_rows(district, candidates, model=DistrictDistance):
+    rows = []
+    for other in candidates:
+        distance = distance_to(district, other)
+        if distance is not None:
+            rows.append(model(origin_id=district.pk, target_id=other.pk, distance_km=distance))
+    return rows
+
+
+def nearby_candidates(district):
+    condition = Q(region_id=district.region_id)
+    if has_centroid(district):
+        lat_cells, lon_cells = cell_span(district.latitude)
+        condition |= Q(
+            cell_lat__range=(district.cell_lat - lat_cells, district.cell_lat + lat_cells),
+            cell_lon__range=(district.cell_lon - lon_cells, district.cell_lon + lon_cells),
+        )
+    return District.objects.filter(condition)
+
+
+def update_district_distances(district):
+    # Пересчёт строк одного района в обе стороны (после изменения координат или региона)
+    rows = distance_rows(district, nearby_candidates(district))
+    reverse = [
+        DistrictDistance(origin_id=row.target_id, target_id=row.origin_id, distance_km=row.distance_km)
+        for row in rows if row.target_id != row.origin_id
+    ]
+    with transaction.atomic():
+        DistrictDistance.objects.filter(Q(origin=district) | Q(target=district)).delete()
+        DistrictDistance.objects.bulk_create(rows + reverse)
+
+
+def rebuild_district_distances(districts=None, distances=None):
+    # Полный пересчёт таблицы; districts и distances передаются из миграции, где нужны исторические модели
+    districts = list(District.objects.all() if districts is None else districts)
+    distances = DistrictDistance.objects.all() if distances is None else distances
+
+    by_cell = defaultdict(list)
+    by_region = defaultdict(list)
+    for district in districts:
+        if has_centroid(district):
+            by_cell[district.cell_lat, district.cell_lon].append(district)
+        by_region[district.region_id].append(district)
+
+    rows = []
+    for district in districts:
+        candidates = {other.pk: other for other in by_region[district.region_id]}
+        if has_centroid(district):
+            lat_cells, lon_cells = cell_span(district.latitude)
+            for cell_lat in range(district.cell_lat - lat_cells, district.cell_lat + lat_cells + 1):
+                for cell_lon in range(district.cell_lon - lon_cells, district.cell_lon + lon_cells + 1):
+                    candidates.update((other.pk, other) for other in by_cell.get((cell_lat, cell_lon), ()))
+        rows += distance_rows(district, candidates.values(), model=distances.model)
+
+    with transaction.atomic():
+        distances.delete()
+        distances.bulk_create(rows, batch_size=1000)
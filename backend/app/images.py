@@ -0,0 +1,114 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import ProductImage
+from .storage import delete_if_orphaned, recently_saved
+from .tasks import enqueue, enqueue_many, task, task_call
+
+DERIVATIVE_WIDTHS = getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (320, 640, 1280))
+DERIVATIVE_QUALITY = 80
+
+_upload_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'UPLOAD_WORKERS', 4), thread_name_prefix='uploads')
+
+
+def derivative_name(name, width):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'derivatives', f'{stem}_{width}.webp')
+
+
+def render_derivatives(image_file):
+    # Возвращает {ширина: байты WebP}. EXIF в производные не копируется,
+    # ориентация из него применяется заранее
+    with Image.open(image_file) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA' if 'A' in original.getbands() else 'RGB')
+
+        result = {}
+        for width in sorted(DERIVATIVE_WIDTHS):
+            # Не увеличиваем: для маленьких оригиналов остаётся одна копия в исходном размере
+            if result and width > original.width:
+                break
+            resized = original.copy()
+            resized.thumbnail((width, width * 10), Image.LANCZOS)
+            buffer = BytesIO()
+            resized.save(buffer, 'WEBP', quality=DERIVATIVE_QUALITY)
+            result[width] = buffer.getvalue()
+        return result
+
+
+@task
+def generate_derivatives(image_id):
+    try:
+        product_image = ProductImage.objects.filter(pk=image_id).first()
+        if product_image is None or not product_image.image:
+            return
+
+        # Та же фотография уже загружалась к другому товару — производные общие
+        existing = ProductImage.objects.filter(image=product_image.image.name).exclude(derivatives={}) \
+            .values_list('derivatives', flat=True).first()
+        if existing:
+            ProductImage.objects.filter(pk=image_id).update(derivatives=existing)
+            return
+
+        with product_image.image.open('rb') as image_file:
+            rendered = render_derivatives(image_file)
+
+        derivatives = {}
+        for width, content in rendered.items():
+            name = default_storage.save(derivative_name(product_image.image.name, width), ContentFile(content))
+            derivatives[str(width)] = name
+        ProductImage.objects.filter(pk=image_id).update(derivatives=derivatives)
+    finally:
+        close_old_connections()
+
+
+def save_uploads(files):
+    # Файлы пишутся в хранилище параллельно, поэтому загрузка длится примерно как самый долгий файл.
+    # Для каждого файла возвращается имя в хранилище или исключение
+    field = ProductImage._meta.get_field('image')
+    futures = [
+        _upload_executor.submit(default_storage.save, field.generate_filename(None, file.name), file)
+        for file in files
+    ]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as error:
+            results.append(error)
+    return results
+
+
+def schedule_derivatives(*image_ids):
+    # Генерация идёт в воркере очереди задач (manage.py run_tasks), запрос её не ждёт
+    enqueue_many([
+        task_call(generate_derivatives, image_id, idempotency_key=f'derivatives:{image_id}') for image_id in image_ids
+    ])
+
+
+def schedule_blob_deletion(name, derivatives=None, run_at=None):
+    # Удаление откладывается на BLOB_DELETE_GRACE секунд: загрузка того же содержимого могла найти файл
+    # в хранилище и ещё не записать свою строку
+    run_at = run_at or timezone.now() + timedelta(seconds=settings.BLOB_DELETE_GRACE)
+    enqueue(delete_orphaned_blob, name, derivatives, run_at=run_at)
+
+
+@task
+def delete_orphaned_blob(name, derivatives=None):
+    # Файл удаляется из хранилища, только если на него больше не ссылается ни одна запись
+    # и его не загружали повторно за последние BLOB_DELETE_GRACE секунд
+    if recently_saved(name):
+        schedule_blob_deletion(name, derivatives)
+        return
+    delete_if_orphaned(name, derivatives)
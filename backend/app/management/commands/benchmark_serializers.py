@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.models import User, Category, SubCategory, Product, Region, District, ProductImage
+from app.read_serializers import ProductListReadSerializer
+from app.serializers import ProductSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость ProductSerializer и ProductListReadSerializer на списке товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # Тестовые данные создаются во временной транзакции и откатываются
+        try:
+            with transaction.atomic():
+                self.create_products(options['rows'])
+                self.run(options['rows'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_products(self, rows):
+        region = Region.objects.create(title='benchmark-region')
+        district = District.objects.create(title='benchmark-district', region=region)
+        category = Category.objects.create(title='benchmark-category')
+        sub_category = SubCategory.objects.create(title='benchmark-sub-category', category=category)
+        owners = User.objects.bulk_create([
+            User(email=f'benchmark{i}@example.com', password='x', phone_number=f'+3759{i:08d}', district=district)
+            for i in range(rows)
+        ])
+        products = Product.objects.bulk_create([
+            Product(title=f'benchmark {i}', description='Описание товара', cost=i, owner=owner, condition='Н',
+                    sub_category=sub_category, region=region, district=district)
+            for i, owner in enumerate(owners)
+        ])
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=f'products/images/benchmark_{product.id}.jpg') for product in products
+        ])
+
+    def run(self, rows, repeat):
+        queryset = Product.objects.with_details().filter(title__startswith='benchmark ')
+
+        def full():
+            return ProductSerializer(list(queryset), many=True).data
+
+        def read():
+            reader = ProductListReadSerializer()
+            return reader.serialize(list(reader.prepare(queryset)))
+
+        timings = {}
+        for name, func in (('ProductSerializer', full), ('ProductListReadSerializer', read)):
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+            self.stdout.write(f'{name}: {best * 1000:.1f} мс на {rows} строк (лучшее из {repeat})')
+
+        speedup = timings['ProductSerializer'] / timings['ProductListReadSerializer']
+        self.stdout.write(self.style.SUCCESS(f'Ускорение: x{speedup:.1f}'))
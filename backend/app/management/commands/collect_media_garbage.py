@@ -0,0 +1,39 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from app.models import User, ProductImage
+from app.storage import BLOBS_DIR, recently_saved
+
+
+class Command(BaseCommand):
+    help = 'Удаляет blob-файлы, на которые больше не ссылается ни одна фотография товара или пользователя'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет удалено')
+
+    def handle(self, *args, **options):
+        referenced = set(ProductImage.objects.values_list('image', flat=True))
+        referenced.update(User.objects.exclude(photo=None).values_list('photo', flat=True))
+        for derivatives in ProductImage.objects.exclude(derivatives={}).values_list('derivatives', flat=True):
+            referenced.update(derivatives.values())
+
+        removed = 0
+        for name in self.walk(BLOBS_DIR):
+            # Недавно сохранённый файл может ждать строку, которая ещё не записана (как в delete_orphaned_blob)
+            if name not in referenced and not recently_saved(name):
+                if not options['dry_run']:
+                    default_storage.delete(name)
+                self.stdout.write(name)
+                removed += 1
+        self.stdout.write(self.style.SUCCESS(f'Неиспользуемых файлов: {removed}'))
+
+    def walk(self, directory):
+        if not default_storage.exists(directory):
+            return
+        directories, files = default_storage.listdir(directory)
+        for filename in files:
+            yield f'{directory}/{filename}'
+        for subdirectory in directories:
+            yield from self.walk(f'{directory}/{subdirectory}')
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from app.views import ProductListCreateView
+
+# Стандартные комбинации фильтров ленты, под которые подобраны индексы Product
+FEED_QUERIES = [
+    ('Лента', {'is_active': 'true', 'sort_by': '-date'}),
+    ('Лента по подкатегории', {'is_active': 'true', 'sub_category': '1', 'sort_by': '-date'}),
+    ('Подкатегория по цене', {'is_active': 'true', 'sub_category': '1', 'sort_by': 'cost'}),
+    ('Диапазон цен', {'is_active': 'true', 'price_min': '10', 'price_max': '100', 'sort_by': 'cost'}),
+    ('Состояние', {'is_active': 'true', 'condition': 'Н', 'sort_by': '-date'}),
+    ('Регион', {'is_active': 'true', 'region': '1', 'sort_by': '-date'}),
+    ('Район', {'is_active': 'true', 'district': '1', 'sort_by': '-date'}),
+    ('Рядом', {'near_district': '1'}),
+    ('Популярные', {'is_active': 'true', 'sort_by': '-favorites_count'}),
+    ('Все товары', {'sort_by': '-date'}),
+]
+
+
+class Command(BaseCommand):
+    help = 'Выводит EXPLAIN для стандартных комбинаций фильтров ленты товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', help='Показать только комбинацию с этим названием')
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        for label, params in FEED_QUERIES:
+            if options['only'] and options['only'] != label:
+                continue
+
+            view = ProductListCreateView()
+            view.request = Request(factory.get('/api/products/', params))
+            view.format_kwarg = None
+            queryset = view.get_queryset()
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{label}: {params}'))
+            self.stdout.write(queryset.explain())
+            self.stdout.write('')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from app.images import generate_derivatives
+from app.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Создаёт производные изображения (WebP) для фотографий товаров, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Пересоздать производные для всех фотографий')
+
+    def handle(self, *args, **options):
+        queryset = ProductImage.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(derivatives={})
+
+        count = 0
+        for image_id in queryset.values_list('id', flat=True).iterator():
+            generate_derivatives(image_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Обработано фотографий: {count}'))
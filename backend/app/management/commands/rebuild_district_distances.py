@@ -0,0 +1,34 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.geo import geo_cell, rebuild_district_distances
+from app.models import District
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает расстояния между районами для ленты «рядом» (можно сначала загрузить координаты из CSV)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--centroids', help='CSV с колонками title,latitude,longitude')
+
+    def handle(self, *args, **options):
+        if options['centroids']:
+            self.load_centroids(options['centroids'])
+        rebuild_district_distances()
+        self.stdout.write(self.style.SUCCESS('Расстояния между районами пересчитаны'))
+
+    def load_centroids(self, path):
+        with open(path, encoding='utf-8') as file:
+            rows = {row['title']: row for row in csv.DictReader(file)}
+        districts = list(District.objects.filter(title__in=rows))
+        missing = set(rows) - {district.title for district in districts}
+        if missing:
+            raise CommandError(f'Нет таких районов: {", ".join(sorted(missing))}')
+
+        for district in districts:
+            # Сигналы не нужны: ячейки считаются здесь, а таблица расстояний строится целиком после загрузки
+            district.latitude = float(rows[district.title]['latitude'])
+            district.longitude = float(rows[district.title]['longitude'])
+            district.cell_lat, district.cell_lon = geo_cell(district.latitude, district.longitude)
+        District.objects.bulk_update(districts, ['latitude', 'longitude', 'cell_lat', 'cell_lon'])
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.facets import FACET_FILTERS, rebuild_facet_counts
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики фасетов товаров (например, после массовых QuerySet.update())'
+
+    def add_arguments(self, parser):
+        parser.add_argument('facets', nargs='*', help=f'Только эти фасеты: {", ".join(FACET_FILTERS)}')
+
+    def handle(self, *args, **options):
+        unknown = set(options['facets']) - set(FACET_FILTERS)
+        if unknown:
+            raise CommandError(f'Неизвестные фасеты: {", ".join(sorted(unknown))}')
+        rebuild_facet_counts(options['facets'] or None)
+        self.stdout.write(self.style.SUCCESS('Счётчики фасетов пересчитаны'))
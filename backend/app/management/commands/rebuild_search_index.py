@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс товаров (например, после массовых QuerySet.update())'
+
+    def handle(self, *args, **options):
+        get_search_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен'))
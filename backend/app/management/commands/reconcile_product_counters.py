@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from app.models import Favorites, Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает Product.favorites_count по таблице избранного. Буферы счётчиков веб-воркеров '
+        '(app/counters.py) команда не видит: приращения, ещё не записанные ими, применятся после пересчёта '
+        'и могут снова дать расхождение — запускайте повторно или после остановки воркеров'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько товаров разошлось')
+
+    def handle(self, *args, **options):
+        actual = Coalesce(
+            Subquery(
+                Favorites.objects.filter(product=OuterRef('pk')).order_by().values('product')
+                .annotate(total=Count('id')).values('total')[:1],
+                output_field=IntegerField(),
+            ),
+            Value(0),
+        )
+        drifted = Product.objects.annotate(actual=actual).exclude(favorites_count=actual)
+        count = drifted.count()
+        negative_views = Product.objects.filter(views_count__lt=0)
+
+        if options['dry_run']:
+            self.stdout.write(f'Расходится favorites_count: {count}, отрицательных views_count: {negative_views.count()}')
+            return
+
+        Product.objects.filter(pk__in=drifted.values('pk')).update(favorites_count=actual)
+        negative_views.update(views_count=0)
+        self.stdout.write(self.style.SUCCESS(f'Исправлено товаров: {count}'))
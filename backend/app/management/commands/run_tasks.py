@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from app.tasks import claim_tasks, prune_tasks, run_task
+
+
+def init_process():
+    # При запуске через spawn (macOS, Windows) Django в дочернем процессе ещё не настроен,
+    # при fork — соединения родителя использовать нельзя
+    django.setup()
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Воркер очереди фоновых задач: выполняет задачи из app_task в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=settings.TASK_WORKERS,
+                            help='Размер пула процессов (0 — выполнять в этом процессе)')
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и выйти')
+        parser.add_argument('--poll-interval', type=float, default=settings.TASK_POLL_INTERVAL)
+
+    def handle(self, *args, **options):
+        self.pruned_at = None
+        if options['processes'] <= 0:
+            self.run_inline(options)
+            return
+
+        # Если дочерний процесс погиб (OOM, падение Pillow), пул становится непригодным —
+        # создаём новый; задачи погибшего пула вернутся в очередь по истечении аренды
+        while not self.run_pool(options):
+            self.stderr.write('Процесс пула завершился аварийно, пул пересоздаётся')
+
+    def run_pool(self, options):
+        connections.close_all()
+        running = set()
+        with ProcessPoolExecutor(max_workers=options['processes'], initializer=init_process) as pool:
+            try:
+                while True:
+                    self.prune()
+                    claimed = claim_tasks(options['processes'] - len(running))
+                    running.update(pool.submit(run_task, task_id) for task_id in claimed)
+                    if options['once'] and not running:
+                        return True
+                    if running:
+                        done, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                        for future in done:
+                            if isinstance(future.exception(), BrokenProcessPool):
+                                raise future.exception()
+                            if future.exception():
+                                self.stderr.write(f'Ошибка процесса воркера: {future.exception()}')
+                    else:
+                        time.sleep(options['poll_interval'])
+            except BrokenProcessPool:
+                return False
+
+    def run_inline(self, options):
+        while True:
+            self.prune()
+            claimed = claim_tasks(1)
+            for task_id in claimed:
+                run_task(task_id)
+            if not claimed:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+
+    def prune(self):
+        # Старые выполненные задачи удаляются не чаще раза в TASK_PRUNE_INTERVAL
+        if self.pruned_at is None or time.monotonic() - self.pruned_at >= settings.TASK_PRUNE_INTERVAL:
+            prune_tasks()
+            self.pruned_at = time.monotonic()
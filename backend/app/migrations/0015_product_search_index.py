@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS app_product_fts USING fts5("
+        "title, description, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS app_product_fts_vocab USING fts5vocab(app_product_fts, 'row')"
+    )
+    # Совпадение в заголовке весит в 10 раз больше, чем в описании
+    schema_editor.execute("INSERT INTO app_product_fts (app_product_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+    schema_editor.execute(
+        "INSERT INTO app_product_fts (rowid, title, description) SELECT id, title, description FROM app_product"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS app_product_fts_vocab")
+    schema_editor.execute("DROP TABLE IF EXISTS app_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_favorites'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_region_district(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    User = apps.get_model('app', 'User')
+    District = apps.get_model('app', 'District')
+
+    Product.objects.update(
+        district_id=models.Subquery(User.objects.filter(pk=models.OuterRef('owner_id')).values('district_id')[:1])
+    )
+    Product.objects.update(
+        region_id=models.Subquery(District.objects.filter(pk=models.OuterRef('district_id')).values('region_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_product_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='district',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='products', to='app.district'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='region',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='products', to='app.region'),
+        ),
+        migrations.RunPython(backfill_region_district, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['region', 'is_active', '-date'], name='product_region_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['district', 'is_active', '-date'], name='product_district_date_idx'),
+        ),
+    ]
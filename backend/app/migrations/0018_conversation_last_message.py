@@ -0,0 +1,31 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_last_message(apps, schema_editor):
+    Conversation = apps.get_model('app', 'Conversation')
+    Message = apps.get_model('app', 'Message')
+
+    Conversation.objects.update(
+        last_message=models.Subquery(
+            Message.objects.filter(conversation=models.OuterRef('pk')).order_by('-sent_at', '-id').values('id')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_product_region_district'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.message'),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_conversation_last_message'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'sent_at'], name='message_conv_sent_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_message_conversation_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
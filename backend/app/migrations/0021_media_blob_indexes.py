@@ -0,0 +1,23 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0020_productimage_derivatives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(db_index=True, upload_to='products/images/'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='photo',
+            field=models.ImageField(blank=True, db_index=True, default='users/none_logo.png', null=True, upload_to='users/'),
+        ),
+    ]
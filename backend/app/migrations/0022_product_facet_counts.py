@@ -0,0 +1,37 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:27
+
+from django.db import migrations, models
+
+
+def backfill_facet_counts(apps, schema_editor):
+    from app.facets import rebuild_facet_counts
+
+    rebuild_facet_counts(
+        products=apps.get_model('app', 'Product').objects.all(),
+        counters=apps.get_model('app', 'ProductFacetCount').objects.all(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_media_blob_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=32)),
+                ('value', models.CharField(max_length=64)),
+                ('is_active', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='productfacetcount',
+            constraint=models.UniqueConstraint(fields=('facet', 'value', 'is_active'), name='product_facet_count_unique'),
+        ),
+        migrations.RunPython(backfill_facet_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_district_distances(apps, schema_editor):
+    from app.geo import rebuild_district_distances
+
+    rebuild_district_distances(
+        districts=apps.get_model('app', 'District').objects.all(),
+        distances=apps.get_model('app', 'DistrictDistance').objects.all(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0022_product_facet_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistrictDistance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance_km', models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='district',
+            name='cell_lat',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='district',
+            name='cell_lon',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='district',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='district',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='district',
+            index=models.Index(fields=['cell_lat', 'cell_lon'], name='district_cell_idx'),
+        ),
+        migrations.AddField(
+            model_name='districtdistance',
+            name='origin',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='distances', to='app.district'),
+        ),
+        migrations.AddField(
+            model_name='districtdistance',
+            name='target',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='incoming_distances', to='app.district'),
+        ),
+        migrations.AddConstraint(
+            model_name='districtdistance',
+            constraint=models.UniqueConstraint(fields=('origin', 'target'), name='district_distance_unique'),
+        ),
+        migrations.RunPython(backfill_district_distances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.db import migrations
+
+
+def hash_plain_passwords(apps, schema_editor):
+    User = apps.get_model('app', 'User')
+    for user in User.objects.exclude(password='').only('id', 'password').iterator():
+        try:
+            identify_hasher(user.password)
+        except ValueError:
+            User.objects.filter(pk=user.pk).update(password=make_password(user.password))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0023_district_distances'),
+    ]
+
+    operations = [
+        migrations.RunPython(hash_plain_passwords, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def remove_duplicate_favorites(apps, schema_editor):
+    Favorites = apps.get_model('app', 'Favorites')
+    keep = Favorites.objects.values('user_id', 'product_id').annotate(keep_id=models.Min('id')).values('keep_id')
+    Favorites.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0024_hash_user_passwords'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_favorites, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='favorites',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorites', to='app.user'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorites',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='favorites_user_product_unique'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:35
+
+from django.db import migrations, models
+
+
+def backfill_favorites_count(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    Favorites = apps.get_model('app', 'Favorites')
+    Product.objects.update(favorites_count=models.functions.Coalesce(
+        models.Subquery(
+            Favorites.objects.filter(product=models.OuterRef('pk')).order_by().values('product')
+            .annotate(total=models.Count('id')).values('total')[:1],
+            output_field=models.IntegerField(),
+        ),
+        models.Value(0),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0025_favorites_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='favorites_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='views_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_favorites_count, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-favorites_count', '-id'], name='product_active_fav_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-views_count', '-id'], name='product_active_views_idx'),
+        ),
+    ]
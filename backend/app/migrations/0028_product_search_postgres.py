@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # То же выражение, что PostgresSearchBackend.vector (app/search.py)
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS app_product_search_idx ON app_product USING GIN (("
+        "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(description, '')), 'B')))"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS app_product_search_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0027_task_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
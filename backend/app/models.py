@@ -1,5 +1,6 @@
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 
 
@@ -13,6 +14,37 @@ CONDITION = (
     ("Н", "Новое")
 )
 
+MAX_PRODUCT_IMAGES = 8
+
+TASK_STATUSES = (
+    ("pending", "Ожидает"),
+    ("running", "Выполняется"),
+    ("done", "Выполнена"),
+    ("failed", "Ошибка")
+)
+
+
+class SparseQuerySet(models.QuerySet):
+    # {ключ ответа сериализатора: (FK модели, путь для select_related, lookup для prefetch_related)}
+    relations = {}
+
+    def sparse(self, fields):
+        # Для ?fields=: загружаются только запрошенные колонки и связи
+        columns = {field.name for field in self.model._meta.concrete_fields}
+        only = ['id'] + [field for field in fields if field in columns]
+        queryset = self
+        for key, (field, select, prefetch) in self.relations.items():
+            if key not in fields:
+                continue
+            if field:
+                only.append(field)
+            if select:
+                queryset = queryset.select_related(select)
+            if prefetch:
+                queryset = queryset.prefetch_related(prefetch() if callable(prefetch) else prefetch)
+        return queryset.only(*only)
+
+
 class Region(models.Model):
     title = models.CharField(max_length=255, unique=True)
 
@@ -23,13 +55,50 @@ class Region(models.Model):
 class District(models.Model):
     title = models.CharField(max_length=255, unique=True)
     region = models.ForeignKey(Region, on_delete=models.CASCADE, related_name='districts')
+    # Координаты центра района и ячейка сетки, в которую он попадает (см. geo.py)
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    cell_lat = models.IntegerField(blank=True, null=True, editable=False)
+    cell_lon = models.IntegerField(blank=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cell_lat', 'cell_lon'], name='district_cell_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 
+class DistrictDistance(models.Model):
+    # Заранее посчитанные расстояния между районами (в пределах NEARBY_MAX_DISTANCE_KM) для ленты «рядом»
+    # Индекс по origin даёт уникальное ограничение (origin, target)
+    origin = models.ForeignKey(District, on_delete=models.CASCADE, db_index=False, related_name='distances')
+    target = models.ForeignKey(District, on_delete=models.CASCADE, related_name='incoming_distances')
+    distance_km = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['origin', 'target'], name='district_distance_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.origin} → {self.target}: {self.distance_km:.0f} км"
+
+
+class UserQuerySet(SparseQuerySet):
+    relations = {
+        'district_details': ('district', 'district__region', None),
+    }
+
+    def with_details(self, fields=None):
+        if fields is not None:
+            return self.sparse(fields)
+        return self.select_related('district__region')
+
+
 class User(models.Model):
-    photo = models.ImageField(upload_to='users/', blank=True, null=True, default="users/none_logo.png")
+    photo = models.ImageField(upload_to='users/', blank=True, null=True, default="users/none_logo.png", db_index=True)
     email = models.EmailField(unique=True)
     password = models.CharField(max_length=255)
     name = models.CharField(max_length=255, default='', blank=True)
@@ -47,6 +116,8 @@ class User(models.Model):
         unique=True,
     )
 
+    objects = UserQuerySet.as_manager()
+
     def __str__(self):
         return self.email
 
@@ -65,6 +136,31 @@ class SubCategory(models.Model):
         return self.title
 
 
+class ProductQuerySet(SparseQuerySet):
+    relations = {
+        'owner_details': ('owner', 'owner__district__region', None),
+        'sub_category_details': ('sub_category', 'sub_category__category', None),
+        'images': (None, None, 'images'),
+    }
+
+    def with_details(self, fields=None):
+        if fields is not None:
+            return self.sparse(fields)
+        # Всё, что читает ProductSerializer, загружается заранее одним планом запроса
+        return self.select_related(
+            'owner__district__region',
+            'sub_category__category',
+        ).prefetch_related('images')
+
+    def with_favorited(self, user):
+        # is_favorited для пользователя из токена считается в том же запросе, что и лента
+        if user is None or not user.is_authenticated:
+            return self
+        return self.annotate(is_favorited=models.Exists(
+            Favorites.objects.filter(user_id=user.id, product=models.OuterRef('pk'))
+        ))
+
+
 class Product(models.Model):
     title = models.CharField(max_length=255, unique=True)
     description = models.TextField(default='')
@@ -74,42 +170,160 @@ class Product(models.Model):
     sub_category = models.ForeignKey(SubCategory, on_delete=models.CASCADE)
     date = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
+    # Копия District/Region владельца, чтобы фильтровать ленту по географии без двух JOIN.
+    # Синхронизируется сигналами в signals.py
+    region = models.ForeignKey(Region, on_delete=models.SET_NULL, blank=True, null=True, db_index=False,
+                               related_name='products')
+    district = models.ForeignKey(District, on_delete=models.SET_NULL, blank=True, null=True, db_index=False,
+                                 related_name='products')
+    # Счётчики популярности для сортировки ленты; пишутся пачками через буфер в counters.py
+    favorites_count = models.IntegerField(default=0)
+    views_count = models.IntegerField(default=0)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # Индексы под реальные фильтры ленты (см. ProductListCreateView и команду explain_product_feed)
+        indexes = [
+            models.Index(fields=['-date', '-id'], name='product_date_idx'),
+            models.Index(fields=['-date', '-id'], name='product_active_date_idx', condition=Q(is_active=True)),
+            models.Index(fields=['sub_category', '-date'], name='product_active_subcat_date_idx',
+                         condition=Q(is_active=True)),
+            models.Index(fields=['sub_category', 'cost'], name='product_active_subcat_cost_idx',
+                         condition=Q(is_active=True)),
+            models.Index(fields=['condition', '-date'], name='product_active_cond_date_idx',
+                         condition=Q(is_active=True)),
+            models.Index(fields=['cost'], name='product_active_cost_idx', condition=Q(is_active=True)),
+            models.Index(fields=['region', 'is_active', '-date'], name='product_region_date_idx'),
+            models.Index(fields=['district', 'is_active', '-date'], name='product_district_date_idx'),
+            models.Index(fields=['-favorites_count', '-id'], name='product_active_fav_idx', condition=Q(is_active=True)),
+            models.Index(fields=['-views_count', '-id'], name='product_active_views_idx', condition=Q(is_active=True)),
+        ]
 
     def __str__(self):
         return self.title
 
 
+class ProductFacetCount(models.Model):
+    # Счётчик товаров для значения фасета (подкатегория, состояние, регион, диапазон цены).
+    # Поддерживается сигналами при сохранении и удалении товаров (см. facets.py)
+    facet = models.CharField(max_length=32)
+    value = models.CharField(max_length=64)
+    is_active = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'value', 'is_active'], name='product_facet_count_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.facet}={self.value}: {self.count}"
+
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='products/images/')
+    image = models.ImageField(upload_to='products/images/', db_index=True)
+    # {ширина: путь к WebP}, заполняется в фоне (см. images.py)
+    derivatives = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return f"Image for {self.product.title}"
 
 
+class ConversationQuerySet(SparseQuerySet):
+    relations = {
+        'participants': (None, None, lambda: models.Prefetch('participants', queryset=User.objects.with_details())),
+        'last_message': ('last_message', 'last_message__sender__district__region', None),
+    }
+
+    def with_details(self, fields=None):
+        if fields is not None:
+            return self.sparse(fields)
+        # Участники и последнее сообщение для списка бесед загружаются фиксированным числом запросов
+        return self.select_related(
+            'last_message__sender__district__region',
+        ).prefetch_related(
+            models.Prefetch('participants', queryset=User.objects.with_details()),
+        )
+
+
 class Conversation(models.Model):
     participants = models.ManyToManyField(User, related_name="conversations")
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    # Обновляется сигналом при создании сообщения, чтобы не искать последнее сообщение для каждой беседы
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, blank=True, null=True,
+                                     related_name='+')
+
+    objects = ConversationQuerySet.as_manager()
 
     def __str__(self):
         return f"Conversation between {', '.join([user.email for user in self.participants.all()])}"
 
 
+class MessageQuerySet(models.QuerySet):
+    def with_details(self):
+        return self.select_related('sender__district__region')
+
+    def newest(self, limit):
+        # Последние limit сообщений в хронологическом порядке
+        return list(reversed(self.order_by('-id')[:limit]))
+
+
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, related_name="messages", on_delete=models.CASCADE)
     sender = models.ForeignKey(User, related_name="sent_messages", on_delete=models.CASCADE)
     text = models.TextField()
     sent_at = models.DateTimeField(default=timezone.now)
 
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'sent_at'], name='message_conv_sent_idx'),
+        ]
+
     def __str__(self):
         return f"Message from {self.sender.email} at {self.sent_at}"
 
 
 class Favorites(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="favorites")
+    # Индекс по user даёт уникальное ограничение (user, product)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False, related_name="favorites")
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="favorites")
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='favorites_user_product_unique'),
+        ]
+
     def __str__(self):
         return f"{self.user.email} at {self.product.title}"
 
+
+class Task(models.Model):
+    # Фоновая задача для воркера manage.py run_tasks (см. tasks.py). Строка создаётся в той же транзакции,
+    # что и данные, поэтому задача не теряется и не выполняется для откаченных изменений
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=TASK_STATUSES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    # Пока не истечёт, задачу выполняет один воркер; после — считается зависшей и берётся снова
+    locked_until = models.DateTimeField(blank=True, null=True)
+    idempotency_key = models.CharField(max_length=255, blank=True, null=True, unique=True)
+    last_error = models.TextField(default='', blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_at'], name='task_pending_idx', condition=Q(status='pending')),
+            models.Index(fields=['locked_until'], name='task_running_idx', condition=Q(status='running')),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
@@ -0,0 +1,170 @@
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .counts import product_count
+
+
+class KeysetPagination(CursorPagination):
+    # Курсор хранит значения всех полей сортировки последней строки страницы,
+    # следующая страница ищется условием (f1, ..., id) > (v1, ..., last_id) без OFFSET,
+    # поэтому одинаковые значения сортировки не ломают пагинацию
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Пагинация включается только по запросу клиента (?cursor= или ?page_size=),
+        # без этих параметров ответ остаётся прежним списком
+        if self.cursor_query_param not in request.query_params \
+                and self.page_size_query_param not in request.query_params:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor['reverse']
+
+        # Назад идём по обратной сортировке от первой строки страницы и разворачиваем результат
+        ordering = [self.reverse_field(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(self.seek(ordering, self.clean_values(queryset, self.cursor['values'])))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    def seek(self, ordering, values):
+        # (f1 > v1) OR (f1 = v1 AND f2 > v2) OR ... — с учётом направления каждого поля
+        conditions = []
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {f.lstrip('-'): value for f, value in zip(ordering[:i], values)}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': values[i]}))
+        return reduce(or_, conditions)
+
+    def clean_values(self, queryset, values):
+        # Значения курсора приводятся к типам полей сортировки: подделанный курсор — 404, а не ошибка базы
+        cleaned = []
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            annotation = queryset.query.annotations.get(name)
+            output_field = annotation.output_field if annotation is not None else queryset.model._meta.get_field(name)
+            try:
+                cleaned.append(output_field.to_python(value))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return cleaned
+
+    def reverse_field(self, field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def row_values(self, row):
+        names = [field.lstrip('-') for field in self.ordering]
+        if isinstance(row, dict):
+            return [row[name] for name in names]
+        return [getattr(row, name) for name in names]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor({'values': self.row_values(self.page[-1]), 'reverse': False})
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor({'values': self.row_values(self.page[0]), 'reverse': True})
+
+    def encode_cursor(self, cursor):
+        values = [{'dt': value.isoformat()} if isinstance(value, datetime) else value for value in cursor['values']]
+        tokens = {'v': values}
+        if cursor['reverse']:
+            tokens['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(tokens, separators=(',', ':')).encode()).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            tokens = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            values = [parse_datetime(value['dt']) if isinstance(value, dict) else value for value in tokens['v']]
+            reverse = bool(tokens.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        # Курсор от другой сортировки (например, после смены sort_by) не подходит
+        if len(values) != len(self.ordering) or None in values:
+            raise NotFound(self.invalid_cursor_message)
+        return {'values': values, 'reverse': reverse}
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+
+class ProductCursorPagination(KeysetPagination):
+    ordering = ('-date', '-id')
+    sort_fields = ('date', '-date', 'cost', '-cost', 'favorites_count', '-favorites_count', 'views_count', '-views_count')
+
+    def get_ordering(self, request, queryset, view):
+        # Поддерживаем ту же сортировку sort_by, что и ProductListCreateView,
+        # id добавляется для однозначного порядка при одинаковых значениях
+        sort_by = request.query_params.get('sort_by')
+        if sort_by in self.sort_fields:
+            return (sort_by, '-id' if sort_by.startswith('-') else 'id')
+        # Лента «рядом» (near_district) идёт от ближайших районов
+        if request.query_params.get('near_district'):
+            return ('distance', '-date', '-id')
+        # Результаты поиска — по релевантности, как и без пагинации
+        if 'search_rank' in queryset.query.annotations:
+            return ('search_rank', '-date', '-id')
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # ?count=exact — общее число товаров из кэша по набору фильтров,
+        # ?count=approximate — оценка по статистике базы для ленты без фильтров
+        self.count = None
+        page = super().paginate_queryset(queryset, request, view)
+        mode = request.query_params.get('count')
+        if page is not None and mode in ('exact', 'approximate'):
+            self.count, self.count_approximate = product_count(
+                queryset, request.query_params, approximate=mode == 'approximate',
+            )
+        return page
+
+    def get_paginated_data(self, data):
+        result = super().get_paginated_data(data)
+        if self.count is not None:
+            result.update({'count': self.count, 'count_approximate': self.count_approximate})
+        return result
+
+
+class MessageCursorPagination(KeysetPagination):
+    ordering = ('sent_at', 'id')
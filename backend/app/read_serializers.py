@@ -0,0 +1,170 @@
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from rest_framework.response import Response
+
+from .models import ProductImage
+from .serializers import requested_fields
+
+# Лёгкие сериализаторы только для чтения списков. Данные берутся через .values() нужными
+# колонками одним запросом (плюс один запрос на фотографии товаров) и собираются в словари
+# без механики ModelSerializer. Формат совпадает с полными сериализаторами, кроме
+# описания пользователя, которое не нужно в списках.
+
+USER_COLUMNS = ('id', 'photo', 'email', 'name', 'gender', 'phone_number', 'district_id',
+                'district__title', 'district__region__title')
+
+
+def iso_datetime(value):
+    # Как DateTimeField в DRF: текущий часовой пояс и "Z" вместо "+00:00"
+    if value is None:
+        return None
+    value = timezone.localtime(value).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class ReadSerializer:
+    # {ключ ответа: колонки .values(), из которых он строится}; порядок ключей — порядок в ответе
+    field_columns = {}
+    # Колонки, которые нужны всегда (id и поля сортировки для курсорной пагинации)
+    required_columns = ('id',)
+
+    def __init__(self, context=None, fields=None):
+        self.request = (context or {}).get('request')
+        self.fields = [key for key in self.field_columns if fields is None or key in fields]
+
+    def prepare(self, queryset):
+        columns = dict.fromkeys(self.required_columns)
+        for key in self.fields:
+            columns.update(dict.fromkeys(self.field_columns[key]))
+        # Аннотации (например, distance для ленты «рядом») могут быть полями сортировки курсорной пагинации
+        columns.update(dict.fromkeys(queryset.query.annotations))
+        return queryset.prefetch_related(None).values(*columns)
+
+    def serialize(self, rows):
+        builders = self.builders(rows)
+        return [{key: builders[key](row) for key in self.fields} for row in rows]
+
+    def builders(self, rows):
+        # {ключ ответа: функция от строки .values()}
+        raise NotImplementedError
+
+    def media_url(self, name):
+        if not name:
+            return None
+        url = default_storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request else url
+
+    def user(self, row, prefix):
+        district_id = row[f'{prefix}district_id']
+        return {
+            'id': row[f'{prefix}id'],
+            'photo': self.media_url(row[f'{prefix}photo']),
+            'email': row[f'{prefix}email'],
+            'name': row[f'{prefix}name'],
+            'gender': row[f'{prefix}gender'],
+            'phone_number': row[f'{prefix}phone_number'],
+            'district': district_id,
+            'district_details': {
+                'id': district_id,
+                'title': row[f'{prefix}district__title'],
+                'region': row[f'{prefix}district__region__title'],
+            } if district_id else None,
+        }
+
+
+class ProductListReadSerializer(ReadSerializer):
+    field_columns = {
+        'id': ('id',),
+        'title': ('title',),
+        'description': ('description',),
+        'cost': ('cost',),
+        'date': ('date',),
+        'condition': ('condition',),
+        'owner_details': tuple(f'owner__{column}' for column in USER_COLUMNS),
+        'sub_category_details': ('sub_category_id', 'sub_category__title', 'sub_category__category__title'),
+        'images': (),
+        'is_active': ('is_active',),
+        'favorites_count': ('favorites_count',),
+        'views_count': ('views_count',),
+        # Аннотация ProductQuerySet.with_favorited попадает в .values() вместе с остальными аннотациями
+        'is_favorited': (),
+    }
+    required_columns = ('id', 'date', 'cost', 'favorites_count', 'views_count')
+
+    def builders(self, rows):
+        images = self.images(rows) if 'images' in self.fields else {}
+        return {
+            'id': lambda row: row['id'],
+            'title': lambda row: row['title'],
+            'description': lambda row: row['description'],
+            'cost': lambda row: row['cost'],
+            'date': lambda row: iso_datetime(row['date']),
+            'condition': lambda row: row['condition'],
+            'owner_details': lambda row: self.user(row, 'owner__'),
+            'sub_category_details': lambda row: {
+                'id': row['sub_category_id'],
+                'title': row['sub_category__title'],
+                'category': row['sub_category__category__title'],
+            },
+            'images': lambda row: images.get(row['id'], []),
+            'is_active': lambda row: row['is_active'],
+            'favorites_count': lambda row: row['favorites_count'],
+            'views_count': lambda row: row['views_count'],
+            'is_favorited': lambda row: row.get('is_favorited', False),
+        }
+
+    def images(self, rows):
+        images = defaultdict(list)
+        product_ids = [row['id'] for row in rows]
+        if not product_ids:
+            return images
+        image_rows = ProductImage.objects.filter(product_id__in=product_ids).order_by('id') \
+            .values('id', 'product_id', 'image', 'derivatives')
+        for image in image_rows:
+            images[image['product_id']].append({
+                'id': image['id'],
+                'product': image['product_id'],
+                'image': self.media_url(image['image']),
+                'derivatives': {width: self.media_url(name) for width, name in image['derivatives'].items()},
+            })
+        return images
+
+
+class MessageListReadSerializer(ReadSerializer):
+    field_columns = {
+        'id': ('id',),
+        'conversation': ('conversation_id',),
+        'sender': ('sender_id',),
+        'text': ('text',),
+        'sent_at': ('sent_at',),
+        'sender_detail': tuple(f'sender__{column}' for column in USER_COLUMNS),
+    }
+    required_columns = ('id', 'sent_at')
+
+    def builders(self, rows):
+        return {
+            'id': lambda row: row['id'],
+            'conversation': lambda row: row['conversation_id'],
+            'sender': lambda row: row['sender_id'],
+            'text': lambda row: row['text'],
+            'sent_at': lambda row: iso_datetime(row['sent_at']),
+            'sender_detail': lambda row: self.user(row, 'sender__'),
+        }
+
+
+class ReadSerializerMixin:
+    # GET-список отдаётся через read_serializer_class, создание и остальное — через serializer_class
+    read_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        reader = self.read_serializer_class(self.get_serializer_context(), fields=requested_fields(request))
+        queryset = reader.prepare(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.serialize(page))
+        return Response(reader.serialize(list(queryset)))
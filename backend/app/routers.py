@@ -0,0 +1,60 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+# Чтение идёт в реплику только в запросах, которые ReplicaPinningMiddleware отметил как безопасные.
+# Вне запросов (воркер задач, команды, поток записи счётчиков) реплика могла бы ещё не видеть
+# только что записанные строки, поэтому там всё читается из основной базы
+_use_replica = ContextVar('use_replica', default=False)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class PrimaryReplicaRouter:
+    # Чтение в отмеченных запросах — в случайную реплику из DATABASE_REPLICAS, остальное — в default
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not replicas or not _use_replica.get():
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def client_key(request):
+    # IP клиента определяется так же, как для лимитов запросов: с учётом NUM_PROXIES,
+    # а не по первому адресу X-Forwarded-For, который клиент может подставить сам
+    return f'primary-pin:{BaseThrottle().get_ident(request)}'
+
+
+class ReplicaPinningMiddleware:
+    # После POST/PATCH/... клиент REPLICA_PIN_SECONDS читает из основной базы,
+    # чтобы сразу увидеть свои изменения, даже если реплика ещё отстаёт
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        write = request.method not in SAFE_METHODS
+        pinned = write or (getattr(settings, 'DATABASE_REPLICAS', []) and cache.get(client_key(request)))
+
+        token = _use_replica.set(not pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_replica.reset(token)
+
+        if write and response.status_code < 400:
+            cache.set(client_key(request), True, getattr(settings, 'REPLICA_PIN_SECONDS', 5))
+        return response
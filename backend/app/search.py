@@ -0,0 +1,161 @@
+import difflib
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class BaseSearchBackend:
+    def index(self, product):
+        raise NotImplementedError
+
+    def remove(self, product_id):
+        raise NotImplementedError
+
+    def rebuild(self):
+        raise NotImplementedError
+
+    def filter(self, queryset, query):
+        # Оставляет только подходящие товары и добавляет аннотацию search_rank
+        # (чем меньше значение, тем выше товар в выдаче)
+        raise NotImplementedError
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    # Запасной вариант для баз без полнотекстового индекса: каждое слово ищется в title или description
+    def index(self, product):
+        pass
+
+    def remove(self, product_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def filter(self, queryset, query):
+        for word in WORD_RE.findall(query):
+            queryset = queryset.filter(Q(title__icontains=word) | Q(description__icontains=word))
+        return queryset.annotate(search_rank=Value(0.0))
+
+
+class SqliteFTSBackend(BaseSearchBackend):
+    table = 'app_product_fts'
+    vocab_table = 'app_product_fts_vocab'
+    # Сколько похожих слов из словаря индекса подставлять вместо слова с опечаткой
+    max_corrections = 3
+    correction_cutoff = 0.75
+
+    def index(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, description) VALUES (%s, %s, %s)',
+                [product.pk, product.title, product.description],
+            )
+
+    def remove(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, description) '
+                f'SELECT id, title, description FROM {Product._meta.db_table}'
+            )
+
+    def filter(self, queryset, query):
+        match = self.build_match(query)
+        if match is None:
+            return queryset.none().annotate(search_rank=Value(0.0))
+
+        product_table = Product._meta.db_table
+        ids = RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [match])
+        # rank — это bm25 с весами из миграции (заголовок важнее описания)
+        rank = RawSQL(
+            f'(SELECT rank FROM {self.table} WHERE {self.table} MATCH %s AND rowid = {product_table}.id)',
+            [match], output_field=FloatField(),
+        )
+        return queryset.filter(id__in=ids).annotate(search_rank=rank)
+
+    def build_match(self, query):
+        parts = []
+        with connection.cursor() as cursor:
+            for word in WORD_RE.findall(query.lower()):
+                variants = [f'"{word}"*']
+                if not self.has_prefix(cursor, word):
+                    variants += [f'"{term}"' for term in self.corrections(cursor, word)]
+                parts.append(f'({" OR ".join(variants)})')
+        return ' AND '.join(parts) if parts else None
+
+    def has_prefix(self, cursor, word):
+        cursor.execute(
+            f'SELECT 1 FROM {self.vocab_table} WHERE term >= %s AND term < %s LIMIT 1',
+            [word, word + '\uffff'],
+        )
+        return cursor.fetchone() is not None
+
+    def corrections(self, cursor, word):
+        # Кандидаты берутся только из слов индекса с той же первой буквой и похожей длины
+        cursor.execute(
+            f'SELECT term FROM {self.vocab_table} WHERE term >= %s AND term < %s '
+            f'AND length(term) BETWEEN %s AND %s',
+            [word[0], word[0] + '\uffff', len(word) - 2, len(word) + 2],
+        )
+        terms = [row[0] for row in cursor.fetchall()]
+        return difflib.get_close_matches(word, terms, n=self.max_corrections, cutoff=self.correction_cutoff)
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    # Полнотекстовый поиск PostgreSQL по GIN-индексу на выражении vector (миграция 0028),
+    # поэтому выражение здесь должно совпадать с индексом. Опечатки не исправляются
+    config = 'russian'
+    vector = (
+        "setweight(to_tsvector('russian', coalesce(app_product.title, '')), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(app_product.description, '')), 'B')"
+    )
+
+    def index(self, product):
+        pass
+
+    def remove(self, product_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def filter(self, queryset, query):
+        words = WORD_RE.findall(query.lower())
+        if not words:
+            return queryset.none().annotate(search_rank=Value(0.0))
+
+        # Каждое слово ищется как префикс, все слова обязательны
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+        ids = RawSQL(
+            f'SELECT id FROM app_product WHERE {self.vector} @@ to_tsquery(%s, %s)', [self.config, tsquery],
+        )
+        rank = RawSQL(
+            f'-ts_rank({self.vector}, to_tsquery(%s, %s))', [self.config, tsquery], output_field=FloatField(),
+        )
+        return queryset.filter(id__in=ids).annotate(search_rank=rank)
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    backend_path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    if connection.vendor == 'sqlite':
+        return SqliteFTSBackend()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return SimpleSearchBackend()
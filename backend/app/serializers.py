@@ -1,9 +1,37 @@
+from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework import serializers
 from .models import User, Category, SubCategory, Product, Region, District, Conversation, Message, CONDITION, \
-    ProductImage
+    ProductImage, Favorites
+from .images import schedule_derivatives
 
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 100
 
 
+def requested_fields(request):
+    # ?fields=id,title,cost — только эти поля; ?expand=images,owner_details — добавить вложенные связи.
+    # Без fields возвращается полный ответ
+    if request is None or request.method != 'GET':
+        return None
+    params = getattr(request, 'query_params', request.GET)
+    fields = params.get('fields')
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(',') if field.strip()}
+    requested.update(field.strip() for field in params.get('expand', '').split(',') if field.strip())
+    return requested
+
+
+class DynamicFieldsMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get('request'))
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
 
 class SubCategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -21,7 +49,7 @@ class CategorySerializer(serializers.ModelSerializer):
 class DistrictSerializer(serializers.ModelSerializer):
     class Meta:
         model = District
-        fields = ['id', 'title']
+        fields = ['id', 'title', 'latitude', 'longitude']
 
 # class DistrictSerializer(serializers.ModelSerializer):
 #     class Meta:
@@ -65,12 +93,23 @@ class SubCategoryUserSerializer(serializers.ModelSerializer):
 
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     district_details = serializers.SerializerMethodField()  # Поле не обязательно
 
     class Meta:
         model = User
         fields = ['id', 'photo', 'email', 'name', 'description', 'gender', 'phone_number', "password", 'district', 'district_details', 'district']
+        # Пароль только принимается и хранится в виде хэша, в ответах его нет
+        extra_kwargs = {'password': {'write_only': True}}
+
+    def create(self, validated_data):
+        validated_data['password'] = make_password(validated_data['password'])
+        return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        if 'password' in validated_data:
+            validated_data['password'] = make_password(validated_data['password'])
+        return super().update(instance, validated_data)
 
     def get_district_details(self, obj):
         # Проверяем, есть ли связанный объект district
@@ -79,6 +118,11 @@ class UserSerializer(serializers.ModelSerializer):
             return DistrictUserSerializer(obj.district).data
         return None  # Если district нет, возвращаем None
 
+class LoginSerializer(serializers.Serializer):
+    email = serializers.EmailField()
+    password = serializers.CharField(trim_whitespace=False)
+
+
 class MessageSerializer(serializers.ModelSerializer):
     sender = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())  # Use PrimaryKeyRelatedField for sender
     sender_detail = UserSerializer(source='sender', read_only=True)
@@ -87,14 +131,24 @@ class MessageSerializer(serializers.ModelSerializer):
         model = Message
         fields = ['id', 'conversation', 'sender', 'text', 'sent_at', 'sender_detail']
 
+    def create(self, validated_data):
+        # Сообщение и указатель Conversation.last_message (сигнал set_last_message) — одна транзакция
+        with transaction.atomic():
+            return super().create(validated_data)
+
 
 class FavoritesSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Message
+        model = Favorites
         fields = ['id', 'user', 'product']
 
 
-class ConversationSerializer(serializers.ModelSerializer):
+class FavoritesBulkSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=500)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=500)
+
+
+class ConversationSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     # Accept IDs as input while returning full user data on output
     participant_ids = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.all(),
@@ -110,7 +164,7 @@ class ConversationSerializer(serializers.ModelSerializer):
         fields = ['id', 'participant_ids', 'participants', 'last_message', 'created_at', 'updated_at']
 
     def get_last_message(self, obj):
-        last_message = obj.messages.last()
+        last_message = obj.last_message
         return MessageSerializer(last_message).data if last_message else None
 
     def create(self, validated_data):
@@ -123,12 +177,17 @@ class ConversationSerializer(serializers.ModelSerializer):
 
 class ConversationDetailSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True)
-    messages = MessageSerializer(many=True, read_only=True)
+    # Только последние сообщения, более старые догружаются через /conversations/<pk>/messages/?before_id=
+    messages = serializers.SerializerMethodField()
 
     class Meta:
         model = Conversation
         fields = ['id', 'participants', 'messages', 'created_at', 'updated_at']
 
+    def get_messages(self, obj):
+        messages = obj.messages.with_details().newest(MESSAGES_PAGE_SIZE)
+        return MessageSerializer(messages, many=True).data
+
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
@@ -138,16 +197,26 @@ class ProductImageSerializer(serializers.ModelSerializer):
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    derivatives = serializers.SerializerMethodField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'product', 'image']
+        fields = ['id', 'product', 'image', 'derivatives']
+
+    def get_derivatives(self, obj):
+        request = self.context.get('request')
+        urls = {}
+        for width, name in obj.derivatives.items():
+            url = default_storage.url(name)
+            urls[width] = request.build_absolute_uri(url) if request else url
+        return urls
 
     def create(self, validated_data):
         # Вы можете добавить здесь дополнительную валидацию, если это необходимо
         return ProductImage.objects.create(**validated_data)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     owner = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), write_only=True)  # Write-only for creation
     owner_details = UserSerializer(source='owner', read_only=True)  # Read-only for retrieval
     condition = serializers.ChoiceField(choices=CONDITION)
@@ -156,22 +225,29 @@ class ProductSerializer(serializers.ModelSerializer):
     # Use PrimaryKeyRelatedField for creation, and a nested serializer for read operations
     sub_category = serializers.PrimaryKeyRelatedField(queryset=SubCategory.objects.all(), write_only=True)
     sub_category_details = SubCategoryUserSerializer(source='sub_category', read_only=True)  # Read-only for retrieval
+    is_favorited = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
         fields = ['id', 'title', 'description', 'cost', 'date', 'condition', 'owner', 'owner_details', 'sub_category',
-                  'sub_category_details', 'images', 'is_active']
+                  'sub_category_details', 'images', 'is_active', 'favorites_count', 'views_count', 'is_favorited']
+        read_only_fields = ['favorites_count', 'views_count']
+
+    def get_is_favorited(self, obj):
+        # Аннотация из ProductQuerySet.with_favorited, без токена — всегда False
+        return getattr(obj, 'is_favorited', False)
 
     def create(self, validated_data):
         images_data = validated_data.pop('images', None)
-        print(f"Received images data: {images_data}")  # Debugging line
-
-        product = Product.objects.create(**validated_data)
 
-        if images_data:
-            for image_data in images_data:
-                print(f"Creating image entry for product: {product.id}")  # Debugging line
-                ProductImage.objects.create(product=product, **image_data)
+        with transaction.atomic():
+            product = Product.objects.create(**validated_data)
+            if images_data:
+                # Одним INSERT; bulk_create не вызывает post_save, поэтому производные ставим в очередь сами
+                images = ProductImage.objects.bulk_create(
+                    [ProductImage(product=product, **image_data) for image_data in images_data]
+                )
+                schedule_derivatives(*[image.pk for image in images])
 
         return product
 
@@ -0,0 +1,174 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.db.models import OuterRef, Q, Subquery
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .caching import invalidate_reference_cache
+from .images import schedule_blob_deletion, schedule_derivatives
+from .models import User, Category, SubCategory, Region, District, Product, Conversation, Message, \
+    ProductImage, Favorites
+from .consumers import conversation_group_name
+from .counters import record_favorites
+from .counts import invalidate_product_counts
+from .geo import geo_cell, has_centroid, update_district_distances
+from .facets import apply_facet_deltas, facet_moves, product_facet_values, rebuild_facet_counts, stored_facet_values, \
+    update_facet_counts
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_backend().index(instance)
+    transaction.on_commit(invalidate_product_counts)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
+    transaction.on_commit(invalidate_product_counts)
+
+
+@receiver(pre_save, sender=Product)
+def remember_facet_values(sender, instance, **kwargs):
+    instance._facet_values_before = stored_facet_values(instance.pk) if instance.pk else set()
+
+
+@receiver(post_save, sender=Product)
+def update_product_facets(sender, instance, **kwargs):
+    update_facet_counts(getattr(instance, '_facet_values_before', set()), product_facet_values(instance))
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_facets(sender, instance, **kwargs):
+    update_facet_counts(product_facet_values(instance), set())
+
+
+@receiver(post_save, sender=Favorites)
+def count_added_favorite(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: record_favorites([instance.product_id], 1))
+
+
+@receiver(post_delete, sender=Favorites)
+def count_removed_favorite(sender, instance, **kwargs):
+    transaction.on_commit(lambda: record_favorites([instance.product_id], -1))
+
+
+@receiver(pre_save, sender=Product)
+def copy_owner_location(sender, instance, **kwargs):
+    district = instance.owner.district
+    instance.district_id = district.pk if district else None
+    instance.region_id = district.region_id if district else None
+
+
+@receiver(post_save, sender=User)
+def sync_products_district(sender, instance, **kwargs):
+    region_id = instance.district.region_id if instance.district else None
+    products = Product.objects.filter(owner=instance).exclude(district_id=instance.district_id)
+    # update() не вызывает сигналы товаров — счётчики фасета региона сдвигаем на товары владельца
+    with transaction.atomic():
+        deltas = facet_moves(products, 'region', region_id)
+        products.update(district_id=instance.district_id, region_id=region_id)
+        apply_facet_deltas(deltas)
+
+
+@receiver(pre_save, sender=District)
+def set_district_cell(sender, instance, **kwargs):
+    cell = geo_cell(instance.latitude, instance.longitude) if has_centroid(instance) else (None, None)
+    instance.cell_lat, instance.cell_lon = cell
+
+
+@receiver(post_save, sender=District)
+def update_distances(sender, instance, **kwargs):
+    update_district_distances(instance)
+
+
+@receiver(post_save, sender=District)
+def sync_products_region(sender, instance, **kwargs):
+    products = Product.objects.filter(district=instance).exclude(region_id=instance.region_id)
+    with transaction.atomic():
+        deltas = facet_moves(products, 'region', instance.region_id)
+        products.update(region_id=instance.region_id)
+        apply_facet_deltas(deltas)
+
+
+@receiver(post_delete, sender=Region)
+def clear_region_facet(sender, instance, **kwargs):
+    # Удаление региона обнуляет Product.region через SET_NULL без сигналов
+    rebuild_facet_counts(['region'])
+
+
+@receiver(post_save, sender=Message)
+def set_last_message(sender, instance, created, **kwargs):
+    # Выполняется в транзакции создания сообщения (MessageSerializer.create). Последнее сообщение —
+    # наибольшее по (sent_at, id), как в restore_last_message и миграции 0018: более новое или
+    # записанное с более поздним sent_at сообщение не перезаписывается старым
+    if created:
+        newer = Q(last_message__sent_at__lt=instance.sent_at) \
+            | Q(last_message__sent_at=instance.sent_at, last_message_id__lt=instance.pk)
+        Conversation.objects.filter(Q(last_message__isnull=True) | newer, pk=instance.conversation_id) \
+            .update(last_message=instance, updated_at=timezone.now())
+        transaction.on_commit(lambda: publish_message(instance))
+
+
+def publish_message(message):
+    # Рассылка нового сообщения участникам, подключённым по WebSocket
+    from .serializers import MessageSerializer
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        conversation_group_name(message.conversation_id),
+        {'type': 'conversation.message', 'message': MessageSerializer(message).data},
+    )
+
+
+@receiver(post_delete, sender=Message)
+def restore_last_message(sender, instance, **kwargs):
+    # SET_NULL уже сбросил указатель, если удалили последнее сообщение — берём предыдущее
+    Conversation.objects.filter(pk=instance.conversation_id, last_message__isnull=True).update(
+        last_message=Subquery(
+            Message.objects.filter(conversation=OuterRef('pk')).order_by('-sent_at', '-id').values('id')[:1]
+        ),
+    )
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=SubCategory)
+@receiver([post_save, post_delete], sender=Region)
+@receiver([post_save, post_delete], sender=District)
+def invalidate_reference_data(sender, **kwargs):
+    transaction.on_commit(lambda: invalidate_reference_cache(sender))
+
+
+@receiver(post_save, sender=ProductImage)
+def create_image_derivatives(sender, instance, created, **kwargs):
+    if created:
+        schedule_derivatives(instance.pk)
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_orphaned_image(sender, instance, **kwargs):
+    if instance.image:
+        schedule_blob_deletion(instance.image.name, instance.derivatives)
+
+
+@receiver(post_delete, sender=User)
+def delete_orphaned_photo(sender, instance, **kwargs):
+    if instance.photo:
+        schedule_blob_deletion(instance.photo.name)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # WAL позволяет читать во время записи, busy_timeout — ждать блокировку, а не падать
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f"PRAGMA busy_timeout={int(connection.settings_dict['OPTIONS'].get('timeout', 20) * 1000)}")
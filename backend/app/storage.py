@@ -0,0 +1,67 @@
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils import timezone
+
+BLOBS_DIR = 'blobs'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    # Файл сохраняется под хэшем содержимого: одинаковые фотографии хранятся один раз,
+    # а содержимое по имени никогда не меняется (можно отдавать с immutable-кэшированием)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        # Производные от blob-файлов (например, миниатюры) уже имеют имя, однозначно выведенное из хэша
+        if not name.startswith(f'{BLOBS_DIR}/'):
+            name = self.hashed_name(name, content)
+        if self.exists(name):
+            # Отметка о повторной загрузке: отложенное удаление (delete_if_orphaned) не тронет файл,
+            # пока строка, которая на него сошлётся, ещё не записана
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return f'{BLOBS_DIR}/{digest[:2]}/{digest}{extension}'
+
+
+def blob_references(name):
+    # Счётчик ссылок считается по строкам, поэтому не может разойтись с данными
+    from .models import User, ProductImage
+
+    return ProductImage.objects.filter(image=name).count() + User.objects.filter(photo=name).count()
+
+
+def recently_saved(name):
+    # Файл сохраняли (или загружали то же содержимое) меньше BLOB_DELETE_GRACE секунд назад
+    if not default_storage.exists(name):
+        return False
+    grace = timedelta(seconds=settings.BLOB_DELETE_GRACE)
+    return default_storage.get_modified_time(name) > timezone.now() - grace
+
+
+def delete_if_orphaned(name, derivatives=None):
+    if not name or blob_references(name):
+        return False
+    for derivative in (derivatives or {}).values():
+        default_storage.delete(derivative)
+    # Файлы вне blobs/ (старые загрузки и users/none_logo.png по умолчанию) не удаляем
+    if name.startswith(f'{BLOBS_DIR}/'):
+        default_storage.delete(name)
+    return True
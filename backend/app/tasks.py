@@ -0,0 +1,120 @@
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# Зарегистрированные задачи: {имя: функция}. Воркер выполняет только их
+TASKS = {}
+
+
+def task(func=None, *, max_attempts=None):
+    # @task — функция может выполняться воркером; аргументы должны сериализоваться в JSON
+    def register(func):
+        func.task_name = f'{func.__module__}.{func.__name__}'
+        func.max_attempts = max_attempts or settings.TASK_MAX_ATTEMPTS
+        TASKS[func.task_name] = func
+        return func
+    return register(func) if func else register
+
+
+def task_call(func, *args, idempotency_key=None, run_at=None, **kwargs):
+    # Несохранённая задача для enqueue_many
+    return Task(
+        name=func.task_name, args=list(args), kwargs=kwargs, max_attempts=func.max_attempts,
+        idempotency_key=idempotency_key, run_at=run_at or timezone.now(),
+    )
+
+
+def enqueue_many(tasks):
+    # Один INSERT на все задачи; задачи с уже известным idempotency_key пропускаются
+    return Task.objects.bulk_create(tasks, ignore_conflicts=True)
+
+
+def enqueue(func, *args, idempotency_key=None, run_at=None, **kwargs):
+    return enqueue_many([task_call(func, *args, idempotency_key=idempotency_key, run_at=run_at, **kwargs)])[0]
+
+
+def due_tasks(now):
+    return Q(status='pending', run_at__lte=now) | Q(status='running', locked_until__lt=now)
+
+
+def fail_abandoned_tasks(now):
+    # Процесс умер посреди задачи (OOM, падение Pillow), а попытки уже исчерпаны —
+    # задача больше не выдаётся, иначе она повторялась бы бесконечно
+    abandoned = Task.objects.filter(status='running', locked_until__lt=now, attempts__gte=F('max_attempts'))
+    for task_id, name in abandoned.values_list('id', 'name'):
+        if abandoned.filter(pk=task_id).update(
+            status='failed', finished_at=now, locked_until=None, last_error='Процесс воркера завершился во время выполнения',
+        ):
+            logger.error('Задача %s (%s) не выполнена: процесс воркера завершился', task_id, name)
+
+
+def claim_tasks(limit):
+    # Задача достаётся тому воркеру, чей условный UPDATE изменил строку — без SELECT FOR UPDATE,
+    # поэтому работает и на SQLite. Попытка засчитывается сразу при выдаче, чтобы упавший
+    # процесс тоже расходовал попытки
+    now = timezone.now()
+    fail_abandoned_tasks(now)
+    candidates = Task.objects.filter(due_tasks(now)).order_by('run_at', 'id').values_list('id', flat=True)[:limit * 2]
+    locked_until = now + timedelta(seconds=settings.TASK_LEASE_SECONDS)
+
+    claimed = []
+    for task_id in candidates:
+        if len(claimed) >= limit:
+            break
+        claim = Task.objects.filter(due_tasks(now), pk=task_id, attempts__lt=F('max_attempts'))
+        if claim.update(status='running', locked_until=locked_until, attempts=F('attempts') + 1):
+            claimed.append(task_id)
+    return claimed
+
+
+def retry_delay(attempts):
+    # Экспоненциальная задержка с небольшим разбросом, чтобы повторы не шли одной волной
+    delay = min(settings.TASK_RETRY_BACKOFF * 2 ** (attempts - 1), settings.TASK_RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * random.uniform(1, 1.1))
+
+
+def run_task(task_id):
+    # Выполняется в процессе пула воркера
+    try:
+        task = Task.objects.filter(pk=task_id).first()
+        if task is None:
+            return
+        try:
+            func = TASKS.get(task.name) or import_string(task.name)
+            if TASKS.get(task.name) is not func:
+                raise LookupError(f'Задача {task.name} не зарегистрирована')
+            func(*task.args, **task.kwargs)
+        except Exception:
+            task.last_error = traceback.format_exc()
+            if task.attempts < task.max_attempts:
+                task.status, task.run_at = 'pending', timezone.now() + retry_delay(task.attempts)
+            else:
+                task.status, task.finished_at = 'failed', timezone.now()
+                logger.error('Задача %s (%s) не выполнена: %s', task.pk, task.name, task.last_error)
+        else:
+            task.status, task.finished_at = 'done', timezone.now()
+        task.locked_until = None
+        task.save(update_fields=['status', 'run_at', 'finished_at', 'locked_until', 'last_error'])
+    finally:
+        close_old_connections()
+
+
+def prune_tasks(now=None):
+    # Выполненные и окончательно упавшие задачи хранятся TASK_RETENTION секунд;
+    # вместе со строкой освобождается и её idempotency_key
+    now = now or timezone.now()
+    deleted, _ = Task.objects.filter(
+        status__in=('done', 'failed'), finished_at__lt=now - timedelta(seconds=settings.TASK_RETENTION),
+    ).delete()
+    return deleted
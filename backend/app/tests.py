@@ -1,3 +1,1030 @@
-from django.test import TestCase
+import json
+import tempfile
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_save
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from .models import User, Category, SubCategory, Product, Region, District, ProductImage, Conversation, Message, \
+    ProductFacetCount, DistrictDistance, Favorites, Task
+from .authentication import SignedTokenAuthentication, issue_token
+from .counters import counter_buffer
+from .read_serializers import ProductListReadSerializer
+from .routers import PrimaryReplicaRouter, ReplicaPinningMiddleware
+from .routing import websocket_urlpatterns
+from .serializers import ProductSerializer
+from .tasks import claim_tasks, enqueue, task
+from .throttling import MemoryThrottleStore, get_throttle_store
+from .views import media_blob
+
+
+def make_catalogue(products_count, images_per_product=2):
+    region, _ = Region.objects.get_or_create(title='Минская')
+    district, _ = District.objects.get_or_create(title='Минский', region=region)
+    category, _ = Category.objects.get_or_create(title='Электроника')
+    sub_category, _ = SubCategory.objects.get_or_create(title='Телефоны', category=category)
+
+    start = User.objects.count()
+    products = []
+    for i in range(start, start + products_count):
+        owner = User.objects.create(
+            email=f'user{i}@example.com',
+            password='secret',
+            phone_number=f'+375{i:09d}',
+            district=district,
+        )
+        product = Product.objects.create(
+            title=f'Товар {i}',
+            cost=10 + i,
+            owner=owner,
+            condition='Н',
+            sub_category=sub_category,
+        )
+        for j in range(images_per_product):
+            ProductImage.objects.create(product=product, image=f'products/images/{i}_{j}.jpg')
+        products.append(product)
+    return products
+
+
+class ProductQueryCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        make_catalogue(2)
+        small, _ = self.count_list_queries()
+
+        Product.objects.all().delete()
+        make_catalogue(20)
+        large, response = self.count_list_queries()
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.json()), 20)
+
+    def test_detail_query_count(self):
+        product = make_catalogue(1, images_per_product=5)[0]
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/products/{product.id}/')
+        self.assertEqual(response.json()['owner_details']['district_details']['region'], 'Минская')
+        self.assertEqual(response.json()['sub_category_details']['category'], 'Электроника')
+        self.assertEqual(len(response.json()['images']), 5)
+
+
+class ProductCursorPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = make_catalogue(7, images_per_product=0)
+
+    def collect_pages(self, params):
+        ids = []
+        response = self.client.get('/api/products/', params)
+        while True:
+            self.assertLessEqual(len(response.json()['results']), params['page_size'])
+            ids.extend(item['id'] for item in response.json()['results'])
+            if not response.json()['next']:
+                return ids
+            response = self.client.get(response.json()['next'])
+
+    def test_without_cursor_params_returns_plain_list(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(len(response.json()), 7)
+
+    def test_pages_cover_feed_in_date_order(self):
+        ids = self.collect_pages({'page_size': 3})
+        self.assertEqual(ids, [p.id for p in reversed(self.products)])
+
+    def test_pages_follow_sort_by(self):
+        Product.objects.filter(id__in=[p.id for p in self.products[:4]]).update(cost=5)
+        ids = self.collect_pages({'page_size': 2, 'sort_by': 'cost'})
+        expected = Product.objects.order_by('cost', 'id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+    def make_tied_products(self, count):
+        # Больше 1000 строк с одинаковой ценой — раньше курсор DRF добирал их через OFFSET и зацикливался
+        owner = self.products[0].owner
+        Product.objects.bulk_create([
+            Product(title=f'Одинаковый {i}', cost=5, owner=owner, condition='Н',
+                    sub_category=self.products[0].sub_category)
+            for i in range(count)
+        ])
+
+    def test_pages_through_more_than_thousand_ties(self):
+        self.make_tied_products(1050)
+        ids = self.collect_pages({'page_size': 100, 'sort_by': 'cost'})
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(ids, list(Product.objects.order_by('cost', 'id').values_list('id', flat=True)))
+
+    def test_popular_feed_pages_through_zero_counters(self):
+        # Почти у всех товаров favorites_count = 0, лента «популярное» не должна повторять строки
+        self.make_tied_products(1050)
+        Product.objects.filter(id=self.products[3].id).update(favorites_count=2)
+        ids = self.collect_pages({'page_size': 100, 'sort_by': '-favorites_count'})
+        self.assertEqual(ids[0], self.products[3].id)
+        self.assertEqual(ids, list(Product.objects.order_by('-favorites_count', '-id').values_list('id', flat=True)))
+
+    def test_tampered_cursor_is_not_found(self):
+        for values in (['abc', 'x'], [{'dt': '2024-01-01T00:00:00+00:00'}, 'x'], [[1], [2]], [{'dt': [1]}, 1]):
+            cursor = urlsafe_b64encode(json.dumps({'v': values}).encode()).decode()
+            response = self.client.get('/api/products/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+    def test_previous_link_returns_previous_page(self):
+        first = self.client.get('/api/products/', {'page_size': 3}).json()
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+        self.assertEqual(self.client.get(back['next']).json()['results'], second['results'])
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        phone, kettle, case = make_catalogue(3, images_per_product=0)
+        phone.title, phone.description = 'Смартфон Samsung Galaxy', 'Отличный телефон'
+        phone.save()
+        kettle.title, kettle.description = 'Электрический чайник', 'Почти как новый смартфон'
+        kettle.save()
+        case.title, case.description = 'Чехол', 'Силиконовый'
+        case.save()
+        self.phone, self.kettle, self.case = phone, kettle, case
+
+    def search(self, query):
+        response = self.client.get('/api/products/', {'title': query})
+        return [item['id'] for item in response.json()]
+
+    def test_ranks_title_matches_above_description_matches(self):
+        self.assertEqual(self.search('смартфон'), [self.phone.id, self.kettle.id])
+
+    def test_paginated_search_keeps_relevance_order(self):
+        first = self.client.get('/api/products/', {'title': 'смартфон', 'page_size': 1}).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual([first['results'][0]['id'], second['results'][0]['id']], [self.phone.id, self.kettle.id])
+        self.assertIsNone(second['next'])
+
+    def test_punctuation_only_query_finds_nothing(self):
+        for query in ('-', '"', '***'):
+            self.assertEqual(self.search(query), [])
+            response = self.client.get('/api/products/', {'title': query, 'page_size': 5})
+            self.assertEqual(response.json()['results'], [])
+            self.assertEqual(self.client.get('/api/products/facets/', {'title': query}).status_code, 200)
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.search('gala'), [self.phone.id])
+
+    def test_typo_tolerance(self):
+        self.assertEqual(self.search('чайнек'), [self.kettle.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.case.title = 'Чехол для смартфона'
+        self.case.save()
+        self.assertIn(self.case.id, self.search('смартфон'))
+
+        self.phone.delete()
+        self.assertNotIn(self.phone.id, self.search('смартфон'))
+
+
+class ProductIndexTests(TestCase):
+    def test_active_feed_uses_partial_index(self):
+        out = StringIO()
+        call_command('explain_product_feed', only='Лента по подкатегории', stdout=out)
+        self.assertIn('product_active_subcat_date_idx', out.getvalue())
+
+    def test_region_feed_uses_denormalized_index(self):
+        out = StringIO()
+        call_command('explain_product_feed', only='Регион', stdout=out)
+        self.assertIn('product_region_date_idx', out.getvalue())
+        self.assertNotIn('app_user_district_id', out.getvalue())
+
+
+class ProductLocationTests(TestCase):
+    def test_product_follows_owner_district(self):
+        product = make_catalogue(1, images_per_product=0)[0]
+        self.assertEqual(product.district, product.owner.district)
+        self.assertEqual(product.region, product.owner.district.region)
+
+        old_region = product.region
+        region = Region.objects.create(title='Гомельская')
+        district = District.objects.create(title='Гомельский', region=region)
+        owner = product.owner
+        owner.district = district
+        owner.save()
+
+        product.refresh_from_db()
+        self.assertEqual((product.district, product.region), (district, region))
+        # Счётчики фасета региона сдвинуты на товар владельца без полного пересчёта
+        self.assertEqual(
+            dict(ProductFacetCount.objects.filter(facet='region').values_list('value', 'count')),
+            {str(old_region.id): 0, str(region.id): 1},
+        )
+
+        response = APIClient().get('/api/products/', {'region': region.id})
+        self.assertEqual([item['id'] for item in response.json()], [product.id])
+
+
+class ConversationInboxTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_catalogue(1, images_per_product=0)[0].owner
+
+    def make_conversations(self, count):
+        for product in make_catalogue(count, images_per_product=0):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.user, product.owner])
+            Message.objects.create(conversation=conversation, sender=self.user, text='Здравствуйте')
+            Message.objects.create(conversation=conversation, sender=product.owner, text=f'Ответ {product.id}')
+
+    def count_inbox_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/conversations/', {'user_id': self.user.id})
+        return len(ctx.captured_queries), response
+
+    def test_inbox_query_count_does_not_depend_on_conversations(self):
+        self.make_conversations(2)
+        small, _ = self.count_inbox_queries()
+        self.make_conversations(10)
+        large, response = self.count_inbox_queries()
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.json()), 12)
+        self.assertTrue(response.json()[0]['last_message']['text'].startswith('Ответ'))
+
+    def test_last_message_follows_create_and_delete(self):
+        self.make_conversations(1)
+        conversation = Conversation.objects.get()
+        first, second = conversation.messages.order_by('id')
+        self.assertEqual(conversation.last_message, second)
+
+        # Более старое сообщение, записавшееся позже, не перетирает указатель
+        post_save.send(sender=Message, instance=first, created=True)
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message, second)
+
+        # Сообщение с более ранним sent_at не становится последним, даже с большим id
+        backdated = Message.objects.create(conversation=conversation, sender=first.sender, text='Задним числом',
+                                           sent_at=first.sent_at - timedelta(minutes=1))
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message, second)
+        backdated.delete()
+
+        second.delete()
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message, first)
+
+
+class ConversationMessagesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        product = make_catalogue(1, images_per_product=0)[0]
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([product.owner])
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, sender=product.owner, text=f'Сообщение {i}')
+            for i in range(60)
+        ]
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data]
+
+    def test_detail_returns_only_newest_messages(self):
+        response = self.client.get(f'/api/conversations/{self.conversation.id}/')
+        ids = [item['id'] for item in response.data['messages']]
+        self.assertEqual(ids, [m.id for m in self.messages[-50:]])
+
+    def test_history_before_and_after_id(self):
+        url = f'/api/conversations/{self.conversation.id}/messages/'
+        older = self.ids(self.client.get(url, {'before_id': self.messages[10].id, 'limit': 5}))
+        self.assertEqual(older, [m.id for m in self.messages[5:10]])
+
+        newer = self.ids(self.client.get(url, {'after_id': self.messages[-3].id}))
+        self.assertEqual(newer, [m.id for m in self.messages[-2:]])
+
+    def test_invalid_params_are_rejected(self):
+        url = f'/api/conversations/{self.conversation.id}/messages/'
+        self.assertEqual(self.client.get(url, {'since': 'вчера'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 'много'}).status_code, 400)
+        for params in ({'limit': 0}, {'limit': -1}, {'limit': -1, 'after_id': self.messages[0].id}):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+
+
+class ConversationWebSocketTests(TransactionTestCase):
+    def setUp(self):
+        first, second = make_catalogue(2, images_per_product=0)
+        self.author, self.reader = first.owner, second.owner
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.author, self.reader])
+
+    def connect(self, user):
+        path = f'/ws/conversations/{self.conversation.id}/?token={issue_token(user)}'
+        return WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+
+    async def test_new_messages_and_typing_are_pushed(self):
+        reader = self.connect(self.reader)
+        connected, _ = await reader.connect()
+        self.assertTrue(connected)
+        author = self.connect(self.author)
+        await author.connect()
+        self.assertEqual((await reader.receive_json_from())['type'], 'presence')
+
+        await author.send_json_to({'type': 'typing'})
+        self.assertEqual(await reader.receive_json_from(), {'type': 'typing', 'user_id': self.author.id})
+
+        await database_sync_to_async(Message.objects.create)(
+            conversation=self.conversation, sender=self.author, text='Привет',
+        )
+        event = await reader.receive_json_from()
+        self.assertEqual((event['type'], event['message']['text']), ('message', 'Привет'))
+
+        await author.disconnect()
+        await reader.disconnect()
+
+    async def test_non_participant_is_rejected(self):
+        outsider = await database_sync_to_async(lambda: make_catalogue(1, images_per_product=0)[0].owner)()
+        connected, _ = await self.connect(outsider).connect()
+        self.assertFalse(connected)
+
+        path = f'/ws/conversations/{self.conversation.id}/?user_id={self.author.id}'
+        connected, _ = await WebsocketCommunicator(URLRouter(websocket_urlpatterns), path).connect()
+        self.assertFalse(connected)
+
+
+class ReferenceCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        make_catalogue(0)
+
+    def test_cached_response_and_not_modified(self):
+        first = self.client.get('/api/categories/')
+        self.assertEqual(first.json()[0]['sub_categories'][0]['title'], 'Телефоны')
+
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+
+    def test_invalidated_by_related_model_change(self):
+        etag = self.client.get('/api/categories/')['ETag']
+        district_etag = self.client.get('/api/districts/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SubCategory.objects.create(title='Ноутбуки', category=Category.objects.get())
+
+        response = self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()[0]['sub_categories']), 2)
+        self.assertEqual(self.client.get('/api/districts/', HTTP_IF_NONE_MATCH=district_etag).status_code, 304)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProductImageDerivativesTests(TestCase):
+    def make_photo(self, size):
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_generates_stripped_webp_derivatives(self):
+        product = make_catalogue(1, images_per_product=0)[0]
+        product_image = ProductImage.objects.create(product=product, image=self.make_photo((1000, 500)))
+
+        call_command('generate_image_derivatives', stdout=StringIO())
+        product_image.refresh_from_db()
+        self.assertEqual(sorted(product_image.derivatives), ['320', '640'])
+
+        with default_storage.open(product_image.derivatives['320']) as f, Image.open(f) as derivative:
+            self.assertEqual((derivative.format, derivative.size), ('WEBP', (320, 160)))
+            self.assertEqual(len(derivative.getexif()), 0)
+
+        response = APIClient().get(f'/api/products/{product.id}/')
+        self.assertTrue(response.json()['images'][0]['derivatives']['640'].endswith('_640.webp'))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProductImageUploadTests(TestCase):
+    def make_photo(self, name):
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), 'blue').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_bulk_upload_enforces_limit_and_reports_per_file(self):
+        product = make_catalogue(1, images_per_product=6)[0]
+        files = [
+            self.make_photo('1.jpg'),
+            SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg'),
+            self.make_photo('2.jpg'),
+            self.make_photo('3.jpg'),
+        ]
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(f'/api/products/{product.id}/upload-images/', {'images': files})
+        statements = [query['sql'].split()[0] for query in ctx.captured_queries]
+        # Один INSERT для фотографий и один для задач на производные
+        self.assertEqual((statements.count('SELECT'), statements.count('INSERT')), (2, 2))
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['success'] for r in results], [True, False, True, False])
+        self.assertEqual(product.images.count(), 8)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ContentAddressedStorageTests(TestCase):
+    def make_photo(self, name, color='green'):
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10), color).save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    @override_settings(BLOB_DELETE_GRACE=0)
+    def test_identical_uploads_share_one_blob_until_last_reference(self):
+        first, second = make_catalogue(2, images_per_product=0)
+        a = ProductImage.objects.create(product=first, image=self.make_photo('a.jpg'))
+        b = ProductImage.objects.create(product=second, image=self.make_photo('b.jpg'))
+        other = ProductImage.objects.create(product=second, image=self.make_photo('c.jpg', color='red'))
+
+        self.assertEqual(a.image.name, b.image.name)
+        self.assertTrue(a.image.name.startswith('blobs/'))
+        self.assertNotEqual(a.image.name, other.image.name)
+
+        # Файлы удаляет воркер очереди задач
+        first.delete()
+        call_command('run_tasks', '--once', '--processes', '0', stdout=StringIO())
+        self.assertTrue(default_storage.exists(b.image.name))
+
+        second.delete()
+        call_command('run_tasks', '--once', '--processes', '0', stdout=StringIO())
+        self.assertFalse(default_storage.exists(b.image.name))
+        self.assertFalse(default_storage.exists(other.image.name))
+
+    def test_reupload_during_grace_period_keeps_blob(self):
+        product = make_catalogue(1, images_per_product=0)[0]
+        image = ProductImage.objects.create(product=product, image=self.make_photo('a.jpg'))
+        name = image.image.name
+        image.delete()
+
+        # То же содержимое загружают снова, а строка со ссылкой ещё не записана
+        self.assertEqual(default_storage.save('products/images/again.jpg', self.make_photo('again.jpg')), name)
+        Task.objects.update(run_at=timezone.now())
+        call_command('run_tasks', '--once', '--processes', '0', stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+        self.assertTrue(Task.objects.filter(name__endswith='delete_orphaned_blob', status='pending').exists())
+
+    def test_garbage_collection_spares_recently_saved_blobs(self):
+        name = default_storage.save('products/images/pending.jpg', self.make_photo('pending.jpg'))
+        call_command('collect_media_garbage', stdout=StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+        with override_settings(BLOB_DELETE_GRACE=0):
+            call_command('collect_media_garbage', stdout=StringIO())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_blobs_are_served_as_immutable(self):
+        product = make_catalogue(1, images_per_product=0)[0]
+        image = ProductImage.objects.create(product=product, image=self.make_photo('a.jpg'))
+        response = media_blob(RequestFactory().get(f'/media/{image.image.name}'), image.image.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+
+class DatabaseConfigurationTests(TestCase):
+    def test_sqlite_waits_for_write_lock(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.DATABASES['default']['OPTIONS']['timeout'] * 1000)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+
+    def read_db_during(self, request, status=200):
+        used = []
+
+        def view(request):
+            used.append(self.router.db_for_read(Product))
+            return HttpResponse(status=status)
+
+        ReplicaPinningMiddleware(view)(request)
+        return used[0]
+
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        self.assertEqual(self.read_db_during(self.factory.get('/api/products/')), 'replica1')
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+
+    def test_reads_outside_requests_go_to_primary(self):
+        # Воркер задач и команды должны видеть только что записанные строки
+        self.assertEqual(self.router.db_for_read(Task), 'default')
+
+    def test_client_reads_own_writes_from_primary(self):
+        self.assertEqual(self.read_db_during(self.factory.post('/api/products/'), status=201), 'default')
+        self.assertEqual(self.read_db_during(self.factory.get('/api/products/')), 'default')
+
+        other_client = self.factory.get('/api/products/', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(self.read_db_during(other_client), 'replica1')
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1})
+    def test_pin_key_ignores_spoofed_forwarded_for(self):
+        self.read_db_during(self.factory.post('/api/products/', HTTP_X_FORWARDED_FOR='10.0.0.9, 10.0.0.3'), status=201)
+        # Клиент за тем же прокси подставил чужой адрес первым — учитывается только адрес от прокси
+        spoofed = self.factory.get('/api/products/', HTTP_X_FORWARDED_FOR='10.0.0.9, 10.0.0.4')
+        self.assertEqual(self.read_db_during(spoofed), 'replica1')
+        own = self.factory.get('/api/products/', HTTP_X_FORWARDED_FOR='10.0.0.3')
+        self.assertEqual(self.read_db_during(own), 'default')
+
+    def test_failed_write_does_not_pin(self):
+        self.read_db_during(self.factory.post('/api/products/'), status=400)
+        self.assertEqual(self.read_db_during(self.factory.get('/api/products/')), 'replica1')
+
+
+class AsyncViewsTests(TestCase):
+    async def test_async_feed_and_detail(self):
+        product = (await database_sync_to_async(make_catalogue)(3))[0]
+        client = AsyncClient()
+
+        response = await client.get('/api/products/', {'sort_by': 'cost'})
+        self.assertEqual([item['id'] for item in response.json()][0], product.id)
+
+        response = await client.get(f'/api/products/{product.id}/')
+        self.assertEqual(response.json()['title'], product.title)
+        self.assertEqual((await client.get('/api/products/0/')).status_code, 404)
+        self.assertEqual((await client.get('/api/products/', {'cursor': 'мусор'})).status_code, 404)
+        self.assertEqual((await client.get('/api/products/', {'near_district': 1, 'radius': 'abc'})).status_code, 400)
+
+    def test_other_methods_use_drf_views(self):
+        product = make_catalogue(1, images_per_product=0)[0]
+        response = APIClient().patch(f'/api/products/{product.id}/', {'is_active': False}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['is_active'])
+
+
+class ReadSerializerTests(TestCase):
+    def test_product_list_matches_full_serializer_without_private_fields(self):
+        make_catalogue(3)
+        factory_request = RequestFactory().get('/api/products/')
+        queryset = Product.objects.with_details().order_by('id')
+
+        reader = ProductListReadSerializer({'request': factory_request})
+        fast = reader.serialize(list(reader.prepare(queryset)))
+        full = ProductSerializer(queryset, many=True, context={'request': factory_request}).data
+
+        for fast_item, full_item in zip(fast, json.loads(json.dumps(full))):
+            full_item['owner_details'].pop('description')
+            self.assertEqual(fast_item, full_item)
+
+    def test_message_list_has_no_password(self):
+        product = make_catalogue(1, images_per_product=0)[0]
+        conversation = Conversation.objects.create()
+        Message.objects.create(conversation=conversation, sender=product.owner, text='Привет')
+
+        item = APIClient().get('/api/messages/').json()[0]
+        self.assertEqual(item['text'], 'Привет')
+        self.assertNotIn('password', item['sender_detail'])
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = make_catalogue(3)
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), ' '.join(query['sql'] for query in ctx.captured_queries)
+
+    def test_product_list_fields_and_expand(self):
+        data, sql = self.get('/api/products/', {'fields': 'id,title,cost', 'expand': 'images'})
+        self.assertEqual(list(data[0]), ['id', 'title', 'cost', 'images'])
+        self.assertEqual(len(data[0]['images']), 2)
+        self.assertNotIn('app_user', sql)
+        self.assertNotIn('"description"', sql)
+
+    def test_product_detail_fields(self):
+        data, sql = self.get(f'/api/products/{self.products[0].id}/', {'fields': 'id,owner_details'})
+        self.assertEqual(list(data), ['id', 'owner_details'])
+        self.assertNotIn('app_productimage', sql)
+        self.assertNotIn('app_subcategory', sql)
+
+    def test_user_and_conversation_fields(self):
+        data, sql = self.get('/api/users/', {'fields': 'id,email'})
+        self.assertEqual(list(data[0]), ['id', 'email'])
+        self.assertNotIn('app_district', sql)
+
+        conversation = Conversation.objects.create()
+        conversation.participants.set([self.products[0].owner])
+        data, sql = self.get('/api/conversations/', {'fields': 'id,updated_at'})
+        self.assertEqual(list(data[0]), ['id', 'updated_at'])
+        self.assertNotIn('app_user', sql)
+
+
+class ProductCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.products = make_catalogue(3, images_per_product=0)
+
+    def test_exact_count_is_cached_until_products_change(self):
+        params = {'page_size': 2, 'count': 'exact', 'price_min': 11}
+        data = self.client.get('/api/products/', params).json()
+        self.assertEqual((data['count'], data['count_approximate']), (2, False))
+        self.assertEqual(len(data['results']), 2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/products/', params)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in ctx.captured_queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].cost = 100
+            self.products[0].save()
+        self.assertEqual(self.client.get('/api/products/', params).json()['count'], 3)
+        self.assertNotIn('count', self.client.get('/api/products/', {'page_size': 2}).json())
+
+    def test_approximate_count_uses_table_statistics(self):
+        data = self.client.get('/api/products/', {'page_size': 2, 'count': 'approximate'}).json()
+        self.assertEqual((data['count'], data['count_approximate']), (3, False))
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        data = self.client.get('/api/products/', {'page_size': 2, 'count': 'approximate'}).json()
+        self.assertEqual((data['count'], data['count_approximate']), (3, True))
+
+
+class ProductFacetsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = make_catalogue(3, images_per_product=0)
+
+    def facets(self, params=None):
+        response = self.client.get('/api/products/facets/', params or {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counters_follow_product_changes(self):
+        product = self.products[0]
+        with self.assertNumQueries(4):
+            data = self.facets({'is_active': 'true'})
+        self.assertEqual(data['sub_category'], [{'value': product.sub_category_id, 'count': 3}])
+        self.assertEqual(data['region'], [{'value': product.region_id, 'count': 3}])
+        self.assertEqual(data['price'], [{'value': '0-50', 'min': 0, 'max': 50, 'count': 3}])
+
+        product.is_active = False
+        product.save()
+        self.products[1].cost = 75
+        self.products[1].save()
+        self.products[2].delete()
+
+        data = self.facets({'is_active': 'true'})
+        self.assertEqual(data['condition'], [{'value': 'Н', 'count': 1}])
+        self.assertEqual(data['price'], [{'value': '50-100', 'min': 50, 'max': 100, 'count': 1}])
+        self.assertEqual(self.facets()['condition'], [{'value': 'Н', 'count': 2}])
+
+    def test_filtered_facets_match_feed(self):
+        data = self.facets({'price_max': 10, 'condition': 'Б'})
+        # Свой фильтр фасета не применяется: видны альтернативы
+        self.assertEqual(data['condition'], [{'value': 'Н', 'count': 1}])
+        self.assertEqual(data['price'], [])
+
+        ProductFacetCount.objects.all().delete()
+        call_command('rebuild_facet_counts', stdout=StringIO())
+        self.assertEqual(self.facets()['sub_category'][0]['count'], 3)
+
+
+class NearbyFeedTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        products = make_catalogue(1, images_per_product=0)
+        self.minsk = products[0].district
+        self.minsk.latitude, self.minsk.longitude = 53.90, 27.56
+        self.minsk.save()
+
+        self.borisov = District.objects.create(title='Борисовский', region=self.minsk.region,
+                                               latitude=54.23, longitude=28.50)
+        self.brest = District.objects.create(title='Брестский', region=Region.objects.create(title='Брестская'),
+                                             latitude=52.10, longitude=23.70)
+        self.logoisk = District.objects.create(title='Логойский', region=self.minsk.region)
+        self.products = {
+            district.title: self.add_product(district) for district in (self.borisov, self.brest, self.logoisk)
+        }
+        self.products[self.minsk.title] = products[0]
+
+    def add_product(self, district):
+        owner = make_catalogue(1, images_per_product=0)[0].owner
+        owner.district = district
+        owner.save()
+        return owner.product_set.get()
+
+    def titles(self, params):
+        response = self.client.get('/api/products/', {'near_district': self.minsk.pk, **params})
+        titles = {product.id: title for title, product in self.products.items()}
+        return [titles[item['id']] for item in response.json()]
+
+    def test_products_are_ranked_by_district_distance(self):
+        self.assertEqual(
+            DistrictDistance.objects.get(origin=self.minsk, target=self.borisov).distance_km,
+            DistrictDistance.objects.get(origin=self.borisov, target=self.minsk).distance_km,
+        )
+        # Брест дальше NEARBY_MAX_DISTANCE_KM, Логойский без координат — по региону
+        self.assertEqual(self.titles({}), ['Минский', 'Борисовский', 'Логойский'])
+        self.assertEqual(self.titles({'radius': 100}), ['Минский', 'Борисовский'])
+
+        first = self.client.get('/api/products/', {'near_district': self.minsk.pk, 'page_size': 2}).json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(first['results']) + len(second['results']), 3)
+
+    def test_pages_through_more_than_thousand_products_in_district(self):
+        # У всех товаров одного района одинаковое distance — порядок держится на (date, id)
+        product = self.products[self.minsk.title]
+        Product.objects.bulk_create([
+            Product(title=f'Рядом {i}', cost=5, owner=product.owner, condition='Н', sub_category=product.sub_category,
+                    district=self.minsk, region=self.minsk.region)
+            for i in range(1050)
+        ])
+        ids = []
+        response = self.client.get('/api/products/', {'near_district': self.minsk.pk, 'page_size': 100}).json()
+        while True:
+            ids.extend(item['id'] for item in response['results'])
+            if not response['next']:
+                break
+            response = self.client.get(response['next']).json()
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), 1053)
+
+    def test_rejects_malformed_numbers(self):
+        for params in ({'radius': 'abc'}, {'radius': 'nan'}, {'near_district': 'x'}):
+            response = self.client.get('/api/products/', {'near_district': self.minsk.pk, **params})
+            self.assertEqual(response.status_code, 400)
+
+    def test_moving_district_updates_distances(self):
+        self.brest.latitude, self.brest.longitude = 54.0, 27.0
+        self.brest.save()
+        self.assertIn('Брестский', self.titles({}))
+
+        call_command('rebuild_district_distances', stdout=StringIO())
+        self.assertEqual(DistrictDistance.objects.filter(origin=self.minsk).count(), 4)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AuthenticationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_catalogue(1, images_per_product=0)[0].owner
+
+    def login(self, password):
+        return self.client.post('/api/auth/login/', {'email': self.user.email, 'password': password}, format='json')
+
+    def test_login_upgrades_plain_password_and_issues_token(self):
+        self.assertEqual(self.login('wrong').status_code, 401)
+        response = self.login('secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('password', response.json()['user'])
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('md5$'))
+        self.assertEqual(self.login('secret').status_code, 200)
+
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {response.json()["token"]}')
+        with self.assertNumQueries(0):
+            user, _ = SignedTokenAuthentication().authenticate(request)
+        self.assertEqual(user.id, self.user.id)
+
+    def test_user_list_rejects_password_filter(self):
+        response = self.client.get('/api/users/', {'email': self.user.email, 'password': 'definitely-wrong'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/users/', {'email': self.user.email})
+        self.assertEqual([item['id'] for item in response.json()], [self.user.id])
+
+    def test_tokens_expire_and_passwords_are_not_exposed(self):
+        token = self.login('secret').json()['token']
+        with override_settings(AUTH_TOKEN_MAX_AGE=-1):
+            response = self.client.get('/api/users/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.patch(f'/api/users/{self.user.id}/', {'password': 'новый'}, format='json')
+        self.assertNotIn('password', response.json())
+        self.assertEqual(self.login('новый').status_code, 200)
+        response = self.client.get('/api/users/', {'password': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json())
+
+
+@override_settings(THROTTLE_RATES={'products': {'user': '3/min', 'ip': '2/min'}, 'login': {'ip': '1/min'}})
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        get_throttle_store().clear()
+        self.client = APIClient()
+
+    def test_sliding_window(self):
+        store = MemoryThrottleStore()
+        self.assertIsNone(store.hit('key', 2, 60, now=30))
+        self.assertIsNone(store.hit('key', 2, 60, now=40))
+        self.assertEqual(store.hit('key', 2, 60, now=50), 10)
+        # Половина предыдущего окна ещё учитывается: 2 * 0.5 + 1 <= 2, затем 2 * 0.5 + 2 > 2
+        self.assertIsNone(store.hit('key', 2, 60, now=90))
+        self.assertEqual(store.hit('key', 2, 60, now=90), 30)
+
+    def test_anonymous_clients_are_limited_per_ip_before_database_work(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get('/api/products/').status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/facets/')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+        other = self.client.get('/api/products/', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(other.status_code, 200)
+
+        post = self.client.post('/api/auth/login/', {'email': 'a@example.com', 'password': 'x'}, format='json')
+        self.assertEqual(post.status_code, 401)
+        post = self.client.post('/api/auth/login/', {'email': 'a@example.com', 'password': 'x'}, format='json')
+        self.assertEqual(post.status_code, 429)
+
+    def test_authenticated_users_have_own_limit(self):
+        user = make_catalogue(1, images_per_product=0)[0].owner
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_token(user)}')
+        statuses = [self.client.get('/api/products/').status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+
+
+class FavoritesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = make_catalogue(3, images_per_product=0)
+        self.user = self.products[0].owner
+
+    def test_bulk_toggle_and_unique_pairs(self):
+        self.assertEqual(self.client.post('/api/favorites/bulk/', {'add': [1]}, format='json').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_token(self.user)}')
+        ids = [product.id for product in self.products]
+
+        response = self.client.post('/api/favorites/bulk/', {'add': ids + [0]}, format='json')
+        self.assertEqual(response.json(), {'added': ids, 'removed': []})
+        response = self.client.post('/api/favorites/bulk/', {'add': ids[:1], 'remove': ids[1:]}, format='json')
+        self.assertEqual(response.json(), {'added': [], 'removed': ids[1:]})
+
+        duplicate = self.client.post('/api/favorites/', {'user': self.user.id, 'product': ids[0]}, format='json')
+        self.assertEqual(duplicate.status_code, 400)
+        favorite = self.client.get('/api/favorites/', {'user': self.user.id}).json()[0]
+        self.assertEqual(self.client.get(f'/api/favorites/{favorite["id"]}/').json()['product'], ids[0])
+
+    def test_feed_marks_favorites_in_the_same_query(self):
+        Favorites.objects.create(user=self.user, product=self.products[1])
+        with CaptureQueriesContext(connection) as anonymous:
+            data = self.client.get('/api/products/', {'sort_by': 'cost'}).json()
+        self.assertEqual([item['is_favorited'] for item in data], [False, False, False])
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_token(self.user)}')
+        with CaptureQueriesContext(connection) as logged_in:
+            data = self.client.get('/api/products/', {'sort_by': 'cost'}).json()
+        self.assertEqual([item['is_favorited'] for item in data], [False, True, False])
+        self.assertEqual(len(anonymous), len(logged_in))
+
+        self.assertTrue(self.client.get(f'/api/products/{self.products[1].id}/').json()['is_favorited'])
+
+
+class ProductCountersTests(TestCase):
+    def setUp(self):
+        counter_buffer.clear()
+        self.client = APIClient()
+        self.products = make_catalogue(3, images_per_product=0)
+
+    def test_views_and_favorites_are_flushed_in_batches(self):
+        for product in (self.products[1], self.products[1], self.products[2]):
+            self.assertEqual(self.client.get(f'/api/products/{product.id}/').status_code, 200)
+
+        user = self.products[0].owner
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_token(user)}')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/favorites/bulk/', {'add': [self.products[2].id, self.products[0].id]},
+                             format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/favorites/bulk/', {'remove': [self.products[0].id]}, format='json')
+        self.assertEqual(Product.objects.get(pk=self.products[1].pk).views_count, 0)
+
+        # Один UPDATE на поле и величину: +2 просмотра, +1 просмотр, +1 в избранное (+1 и -1 взаимно сократились)
+        with CaptureQueriesContext(connection) as ctx:
+            counter_buffer.flush()
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in ctx.captured_queries), 3)
+        data = self.client.get('/api/products/', {'sort_by': '-favorites_count', 'page_size': 1}).json()
+        self.assertEqual((data['results'][0]['id'], data['results'][0]['favorites_count']), (self.products[2].id, 1))
+        self.assertEqual(Product.objects.get(pk=self.products[1].pk).views_count, 2)
+
+    def test_reconciliation_repairs_drift(self):
+        Favorites.objects.create(user=self.products[0].owner, product=self.products[1])
+        Product.objects.filter(pk=self.products[0].pk).update(favorites_count=5)
+        call_command('reconcile_product_counters', stdout=StringIO())
+        self.assertEqual(
+            list(Product.objects.order_by('id').values_list('favorites_count', flat=True)), [0, 1, 0],
+        )
+
+
+@task(max_attempts=2)
+def flaky_task(key, failures):
+    cache.set(key, cache.get(key, 0) + 1)
+    if cache.get(key) <= failures:
+        raise RuntimeError('Сбой')
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def run_worker(self):
+        call_command('run_tasks', '--once', '--processes', '0', stdout=StringIO())
+
+    def test_idempotency_keys_and_retries_with_backoff(self):
+        enqueue(flaky_task, 'ok', failures=1, idempotency_key='ok')
+        enqueue(flaky_task, 'ok', failures=1, idempotency_key='ok')
+        enqueue(flaky_task, 'broken', failures=5)
+        self.assertEqual(Task.objects.count(), 2)
+
+        self.run_worker()
+        self.assertEqual(
+            list(Task.objects.order_by('id').values_list('status', 'attempts')), [('pending', 1), ('pending', 1)],
+        )
+        self.assertTrue(all(task.run_at > timezone.now() for task in Task.objects.all()))
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('app.tasks', 'ERROR'):
+            self.run_worker()
+        ok, broken = Task.objects.order_by('id')
+        self.assertEqual((ok.status, ok.attempts, cache.get('ok')), ('done', 2, 2))
+        self.assertEqual((broken.status, broken.attempts), ('failed', 2))
+        self.assertIn('RuntimeError', broken.last_error)
+
+    def test_stale_running_tasks_are_reclaimed(self):
+        enqueue(flaky_task, 'stale', failures=0)
+        self.assertEqual(len(claim_tasks(5)), 1)
+        self.assertEqual(claim_tasks(5), [])
+
+        Task.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.run_worker()
+        self.assertEqual(Task.objects.get().status, 'done')
+
+    def test_crashed_tasks_use_up_attempts(self):
+        # Процесс умирает до записи результата: попытка засчитана уже при выдаче задачи
+        enqueue(flaky_task, 'crash', failures=0)
+        for attempt in (1, 2):
+            self.assertEqual(len(claim_tasks(5)), 1)
+            self.assertEqual(Task.objects.get().attempts, attempt)
+            Task.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        with self.assertLogs('app.tasks', 'ERROR'):
+            self.assertEqual(claim_tasks(5), [])
+        self.assertEqual(Task.objects.get().status, 'failed')
+
+    def test_worker_prunes_old_finished_tasks(self):
+        for key in ('old', 'fresh', 'pending'):
+            enqueue(flaky_task, key, failures=0, idempotency_key=key)
+        Task.objects.exclude(idempotency_key='pending').update(status='done', finished_at=timezone.now())
+        Task.objects.filter(idempotency_key='old').update(
+            finished_at=timezone.now() - timedelta(seconds=settings.TASK_RETENTION + 1),
+        )
+        Task.objects.filter(idempotency_key='pending').update(run_at=timezone.now() + timedelta(hours=1))
+
+        self.run_worker()
+        self.assertEqual(sorted(Task.objects.values_list('idempotency_key', flat=True)), ['fresh', 'pending'])
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp(), BLOB_DELETE_GRACE=0)
+    def test_product_images_are_processed_by_worker(self):
+        product = make_catalogue(1, images_per_product=0)[0]
+        buffer = BytesIO()
+        Image.new('RGB', (400, 200), 'green').save(buffer, 'JPEG')
+        photo = SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+        product_image = ProductImage.objects.create(product=product, image=photo)
+        self.assertEqual(Task.objects.get().idempotency_key, f'derivatives:{product_image.id}')
+
+        self.run_worker()
+        product_image.refresh_from_db()
+        self.assertEqual(list(product_image.derivatives), ['320'])
+
+        name = product_image.image.name
+        product_image.delete()
+        self.run_worker()
+        self.assertFalse(default_storage.exists(name))
@@ -0,0 +1,143 @@
+import math
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+# Ограничение частоты запросов скользящим окном: счётчики текущего и предыдущего окна,
+# предыдущее учитывается с весом оставшейся доли окна. Лимиты — settings.THROTTLE_RATES
+# по throttle_scope представления, отдельно для пользователей с токеном и для анонимов по IP
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+def parse_rate(rate):
+    # '120/min' -> (120, 60)
+    if rate is None:
+        return None
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class BaseThrottleStore:
+    def incr(self, key, timeout):
+        raise NotImplementedError
+
+    def decr(self, key):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def hit(self, key, limit, period, now=None):
+        # None, если запрос укладывается в лимит (и засчитан), иначе сколько секунд подождать
+        now = time.time() if now is None else now
+        window, elapsed = divmod(now, period)
+        current_key, previous_key = f'{key}:{int(window)}', f'{key}:{int(window) - 1}'
+
+        current = self.incr(current_key, timeout=2 * period)
+        previous = self.get(previous_key)
+        weight = 1 - elapsed / period
+        if previous * weight + current <= limit:
+            return None
+
+        # Отклонённые запросы не засчитываются, иначе клиент, который продолжает стучаться, не разблокируется
+        self.decr(current_key)
+        current -= 1
+        remaining = period - elapsed
+        if previous and current < limit:
+            # Через сколько вклад предыдущего окна уменьшится настолько, что запрос пройдёт
+            remaining = min(remaining, period * (previous * weight + current + 1 - limit) / previous)
+        return max(1, math.ceil(remaining))
+
+
+class MemoryThrottleStore(BaseThrottleStore):
+    # Счётчики в памяти процесса: у каждого воркера свои лимиты
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def incr(self, key, timeout):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.counters) > 10000:
+                self.counters = {k: v for k, v in self.counters.items() if v[1] > now}
+            count, expires = self.counters.get(key, (0, now + timeout))
+            if expires <= now:
+                count, expires = 0, now + timeout
+            self.counters[key] = (count + 1, expires)
+            return count + 1
+
+    def decr(self, key):
+        with self.lock:
+            if key in self.counters:
+                count, expires = self.counters[key]
+                self.counters[key] = (count - 1, expires)
+
+    def get(self, key):
+        with self.lock:
+            count, expires = self.counters.get(key, (0, 0))
+            return count if expires > time.monotonic() else 0
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+
+
+class CacheThrottleStore(BaseThrottleStore):
+    # Счётчики в кэше Django (Redis при REDIS_URL) — общие лимиты для всех воркеров
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'THROTTLE_CACHE', 'default')]
+
+    def incr(self, key, timeout):
+        key = f'throttle:{key}'
+        self.cache.add(key, 0, timeout)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Ключ истёк между add и incr
+            self.cache.set(key, 1, timeout)
+            return 1
+
+    def decr(self, key):
+        try:
+            self.cache.decr(f'throttle:{key}')
+        except ValueError:
+            pass
+
+    def get(self, key):
+        return self.cache.get(f'throttle:{key}', 0)
+
+    def clear(self):
+        self.cache.clear()
+
+
+@lru_cache(maxsize=None)
+def get_throttle_store():
+    return import_string(getattr(settings, 'THROTTLE_STORE', 'app.throttling.MemoryThrottleStore'))()
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    # Лимиты представления задаются атрибутом throttle_scope (по умолчанию 'default')
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        scope = getattr(view, 'throttle_scope', None) or 'default'
+        user = request.user
+        if user is not None and user.is_authenticated:
+            kind, ident = 'user', user.id
+        else:
+            kind, ident = 'ip', self.get_ident(request)
+
+        rate = parse_rate(settings.THROTTLE_RATES.get(scope, {}).get(kind))
+        if rate is None:
+            return True
+        limit, period = rate
+        self.wait_seconds = get_throttle_store().hit(f'{scope}:{kind}:{ident}', limit, period)
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
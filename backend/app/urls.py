@@ -1,26 +1,33 @@
 from django.urls import path
+from .async_views import get_async, product_list, product_detail, conversation_list
 from .views import (
-    UserListCreateView, UserDetailView, CategoryListCreateView, SubCategoryListCreateView,
-    ProductListCreateView, ProductDetailView, RegionListCreateView, DistrictListCreateView,
-    ConversationListCreateView, ConversationDetailView, MessageListCreateView, MessageDetailView,
-    ProductImageListCreateView, ProductImageUploadView, FavoritesListCreateView, FavoritesDetailView
+    LoginView, UserListCreateView, UserDetailView, CategoryListCreateView, SubCategoryListCreateView,
+    ProductListCreateView, ProductFacetsView, ProductDetailView, RegionListCreateView, DistrictListCreateView,
+    ConversationListCreateView, ConversationDetailView, ConversationMessageListView, MessageListCreateView,
+    MessageDetailView, ProductImageListCreateView, ProductImageUploadView, FavoritesListCreateView, FavoritesBulkView,
+    FavoritesDetailView
 )
 
 urlpatterns = [
+    path('auth/login/', LoginView.as_view(), name='login'),
+
     path('users/', UserListCreateView.as_view(), name='user-list-create'),
     path('users/<int:pk>/', UserDetailView.as_view(), name='user-detail'),
 
     path('categories/', CategoryListCreateView.as_view(), name='category-list-create'),
     path('subcategories/', SubCategoryListCreateView.as_view(), name='subcategory-list-create'),
 
-    path('products/', ProductListCreateView.as_view(), name='product-list-create'),
-    path('products/<int:pk>/', ProductDetailView.as_view(), name='product-detail'),
+    path('products/', get_async(product_list, ProductListCreateView.as_view()), name='product-list-create'),
+    path('products/facets/', ProductFacetsView.as_view(), name='product-facets'),
+    path('products/<int:pk>/', get_async(product_detail, ProductDetailView.as_view()), name='product-detail'),
 
     path('regions/', RegionListCreateView.as_view(), name='region-list-create'),
     path('districts/', DistrictListCreateView.as_view(), name='district-list-create'),
 
-    path('conversations/', ConversationListCreateView.as_view(), name='conversation-list-create'),
+    path('conversations/', get_async(conversation_list, ConversationListCreateView.as_view()),
+         name='conversation-list-create'),
     path('conversations/<int:pk>/', ConversationDetailView.as_view(), name='conversation-detail'),
+    path('conversations/<int:pk>/messages/', ConversationMessageListView.as_view(), name='conversation-messages'),
 
     path('messages/', MessageListCreateView.as_view(), name='message-list-create'),
     path('messages/<int:pk>/', MessageDetailView.as_view(), name='message-detail'),
@@ -29,5 +36,6 @@ urlpatterns = [
     path('products/<int:product_id>/upload-images/', ProductImageUploadView.as_view(), name='upload_product_images'),
 
     path('favorites/', FavoritesListCreateView.as_view(), name='favorites-image-list-create'),
-    path('favorites/<int:favorit_id>/', FavoritesDetailView.as_view(), name='favorites-detail'),
+    path('favorites/bulk/', FavoritesBulkView.as_view(), name='favorites-bulk'),
+    path('favorites/<int:pk>/', FavoritesDetailView.as_view(), name='favorites-detail'),
 ]
@@ -1,24 +1,50 @@
+import math
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
 from django.shortcuts import get_object_or_404
-from rest_framework import generics, serializers
+from django.utils.dateparse import parse_datetime
+from django.views.static import serve
+from rest_framework import exceptions, generics, serializers, status
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from .models import User, Category, SubCategory, Product, Region, District, Conversation, Message, ProductImage, \
-    Favorites
+    Favorites, MAX_PRODUCT_IMAGES
+from .authentication import issue_token, verify_password
+from .caching import CachedListMixin
+from .counters import record_favorites, record_view
+from .counts import COUNT_FILTERS
+from .facets import FACET_FILTERS, aggregate_facet, counted_facet, facet_items
+from .images import save_uploads, schedule_derivatives
+from .pagination import ProductCursorPagination, MessageCursorPagination
+from .read_serializers import ReadSerializerMixin, ProductListReadSerializer, MessageListReadSerializer
+from .search import get_search_backend
 from .serializers import (
     UserSerializer, CategorySerializer, SubCategorySerializer, ProductSerializer,
     RegionSerializer, DistrictSerializer, ConversationSerializer, MessageSerializer, ProductImageSerializer,
-    ConversationDetailSerializer, FavoritesSerializer
+    ConversationDetailSerializer, FavoritesSerializer, FavoritesBulkSerializer, LoginSerializer, MESSAGES_PAGE_SIZE, MESSAGES_MAX_PAGE_SIZE, requested_fields
 )
 from django_filters import rest_framework as filters
 
 
 class UserFilter(filters.FilterSet):
     email = filters.CharFilter(lookup_expr='exact')
+    # Старый вход «фильтром по паролю»: без явной ошибки параметр молча игнорировался бы
+    # и пользователь находился по одному email, поэтому такие запросы отклоняются
+    password = filters.CharFilter(method='reject_password')
 
     class Meta:
         model = User
-        fields = ['email', 'password']
+        fields = ['email']
+
+    def reject_password(self, queryset, name, value):
+        raise serializers.ValidationError({'password': 'Вход выполняется через /api/auth/login/.'})
 
 
 # Для пользователей
@@ -28,134 +54,272 @@ class UserListCreateView(generics.ListCreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    def get_queryset(self):
+        return User.objects.with_details(requested_fields(self.request))
+
 
 class UserDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    def get_queryset(self):
+        return User.objects.with_details(requested_fields(self.request))
+
+
+class LoginView(APIView):
+    # Вход по email и паролю: в ответе подписанный токен для заголовка Authorization: Bearer <токен>
+    throttle_scope = 'login'
+
+    def post(self, request):
+        serializer = LoginSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        email, password = serializer.validated_data['email'], serializer.validated_data['password']
+
+        user = User.objects.with_details().filter(email=email).first()
+        if user is None:
+            # Хэшируем впустую, чтобы по времени ответа нельзя было узнать, есть ли такой email
+            make_password(password)
+        if user is None or not verify_password(user, password):
+            raise exceptions.AuthenticationFailed('Неверный email или пароль')
+
+        return Response({
+            'token': issue_token(user),
+            'user': UserSerializer(user, context={'request': request}).data,
+        })
+
 
 # Для категорий и подкатегорий
-class CategoryListCreateView(generics.ListCreateAPIView):
-    queryset = Category.objects.all()
+class CategoryListCreateView(CachedListMixin, generics.ListCreateAPIView):
+    queryset = Category.objects.prefetch_related('sub_categories')
     serializer_class = CategorySerializer
+    cache_name = 'categories'
 
 
-class SubCategoryListCreateView(generics.ListCreateAPIView):
+class SubCategoryListCreateView(CachedListMixin, generics.ListCreateAPIView):
     queryset = SubCategory.objects.all()
     serializer_class = SubCategorySerializer
+    cache_name = 'subcategories'
 
 
 # Для продуктов
 
-class ProductListCreateView(generics.ListCreateAPIView):
-    queryset = Product.objects.all()
+def number_param(name, value, cast, message):
+    # Некорректное число в параметре ленты — ошибка 400, а не исключение ORM
+    try:
+        number = cast(value)
+    except ValueError:
+        raise serializers.ValidationError({name: message})
+    if not math.isfinite(number) or number < 0:
+        raise serializers.ValidationError({name: message})
+    return number
+
+
+def filter_products(params, user=None):
+    # Общая логика фильтрации ленты для ProductListCreateView и асинхронной ленты (async_views.py)
+    queryset = Product.objects.with_details().with_favorited(user)
+
+    # Получение параметров запроса
+    title = params.get('title', None)
+    condition = params.get('condition', None)
+    sub_category = params.get('sub_category', None)
+    price_min = params.get('price_min', None)
+    price_max = params.get('price_max', None)
+    region = params.get('region', None)
+    district = params.get('district', None)
+    owner_id = params.get('owner_id', None)
+    sort_by = params.get('sort_by', None)
+    is_active = params.get('is_active', None)
+    near_district = params.get('near_district', None)
+    radius = params.get('radius', None)
+
+    if is_active == "true":
+        queryset = queryset.filter(is_active=True)
+    elif is_active == "false":
+        queryset = queryset.filter(is_active=False)
+
+    # Полнотекстовый поиск по названию и описанию
+    if title:
+        queryset = get_search_backend().filter(queryset, title)
+
+    # Фильтрация по состоянию товара (если не пустое)
+    if condition:
+        queryset = queryset.filter(condition=condition)
+
+    # Фильтрация по подкатегории (если не пустое)
+    if sub_category:
+        queryset = queryset.filter(sub_category=sub_category)
+
+    # Фильтрация по минимальной цене (если передана)
+    if price_min:
+        queryset = queryset.filter(cost__gte=price_min)
+
+    # Фильтрация по максимальной цене (если передана)
+    if price_max:
+        queryset = queryset.filter(cost__lte=price_max)
+
+    # Фильтрация по региону владельца (если не пустое)
+    if region:
+        queryset = queryset.filter(region=region)
+
+    # Фильтрация по району владельца (если не пустое)
+    if district:
+        queryset = queryset.filter(district=district)
+
+    # Фильтрация по владельцу (если не пустое)
+    if owner_id:
+        queryset = queryset.filter(owner__id=owner_id)
+
+    # Лента «рядом»: активные товары из районов, до которых есть строка в DistrictDistance
+    if near_district:
+        near_district = number_param('near_district', near_district, int, 'Ожидается целое число.')
+        queryset = queryset.filter(is_active=True, district__incoming_distances__origin=near_district) \
+            .annotate(distance=F('district__incoming_distances__distance_km'))
+        if radius:
+            radius = number_param('radius', radius, float, 'Ожидается число километров.')
+            queryset = queryset.filter(distance__lte=radius)
+
+    # Сортировка по дате или цене (если указаны корректные параметры)
+    if sort_by:
+        queryset = queryset.order_by(sort_by)
+    elif near_district:
+        queryset = queryset.order_by('distance', '-date', '-id')
+    # Без явной сортировки результаты поиска идут по релевантности
+    elif title:
+        queryset = queryset.order_by('search_rank', '-date', '-id')
+
+    return queryset
+
+
+class ProductListCreateView(ReadSerializerMixin, generics.ListCreateAPIView):
+    throttle_scope = 'products'
+    queryset = Product.objects.with_details()
     serializer_class = ProductSerializer
+    read_serializer_class = ProductListReadSerializer
+    pagination_class = ProductCursorPagination
 
     def get_queryset(self):
-        queryset = Product.objects.all()
-
-        # Получение параметров запроса
-        title = self.request.query_params.get('title', None)
-        condition = self.request.query_params.get('condition', None)
-        sub_category = self.request.query_params.get('sub_category', None)
-        price_min = self.request.query_params.get('price_min', None)
-        price_max = self.request.query_params.get('price_max', None)
-        region = self.request.query_params.get('region', None)
-        district = self.request.query_params.get('district', None)
-        owner_id = self.request.query_params.get('owner_id', None)
-        sort_by = self.request.query_params.get('sort_by', None)
-        is_active = self.request.query_params.get('is_active', None)
+        return filter_products(self.request.query_params, self.request.user)
 
-        print(is_active)
 
-        if is_active == "true":
-            queryset = queryset.filter(is_active=True)
-        elif is_active == "false":
-            queryset = queryset.filter(is_active=False)
-
-        if title:
-            queryset = queryset.filter(title__icontains=title)
-
-        # Фильтрация по состоянию товара (если не пустое)
-        if condition:
-            queryset = queryset.filter(condition=condition)
-
-        # Фильтрация по подкатегории (если не пустое)
-        if sub_category:
-            queryset = queryset.filter(sub_category=sub_category)
-
-        # Фильтрация по минимальной цене (если передана)
-        if price_min:
-            queryset = queryset.filter(cost__gte=price_min)
-
-        # Фильтрация по максимальной цене (если передана)
-        if price_max:
-            queryset = queryset.filter(cost__lte=price_max)
-
-        # Фильтрация по региону владельца (если не пустое)
-        if region:
-            queryset = queryset.filter(owner__district__region=region)
-
-        # Фильтрация по району владельца (если не пустое)
-        if district:
-            queryset = queryset.filter(owner__district=district)
-
-        # Фильтрация по владельцу (если не пустое)
-        if owner_id:
-            queryset = queryset.filter(owner__id=owner_id)
-
-        # Сортировка по дате или цене (если указаны корректные параметры)
-        if sort_by:
-            queryset = queryset.order_by(sort_by)
-
-        return queryset
+class ProductFacetsView(APIView):
+    # Количества по подкатегориям, состояниям, регионам и диапазонам цены для текущих фильтров ленты
+    throttle_scope = 'products'
 
+    def get(self, request):
+        facets = {}
+        for facet, facet_filters in FACET_FILTERS.items():
+            params = request.query_params.copy()
+            for name in facet_filters:
+                params.pop(name, None)
 
+            # Без фильтров (кроме is_active) — готовые счётчики, иначе один GROUP BY по отфильтрованной ленте
+            if any(params.get(name) for name in COUNT_FILTERS if name != 'is_active'):
+                counts = aggregate_facet(filter_products(params), facet)
+            else:
+                counts = counted_facet(facet, params.get('is_active'))
+            facets[facet] = facet_items(facet, {str(value): count for value, count in counts.items()})
+        return Response(facets)
 
 
 class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.all()
+    throttle_scope = 'products'
+    queryset = Product.objects.with_details()
     serializer_class = ProductSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        record_view(self.kwargs['pk'])
+        return response
+
+    def get_queryset(self):
+        return Product.objects.with_details(requested_fields(self.request)).with_favorited(self.request.user)
+
 
 # Для регионов и районов
-class RegionListCreateView(generics.ListCreateAPIView):
-    queryset = Region.objects.all()
+class RegionListCreateView(CachedListMixin, generics.ListCreateAPIView):
+    queryset = Region.objects.prefetch_related('districts')
     serializer_class = RegionSerializer
+    cache_name = 'regions'
 
 
-class DistrictListCreateView(generics.ListCreateAPIView):
+class DistrictListCreateView(CachedListMixin, generics.ListCreateAPIView):
     queryset = District.objects.all()
     serializer_class = DistrictSerializer
+    cache_name = 'districts'
 
 
 # Для бесед
+def filter_conversations(params, fields=None):
+    queryset = Conversation.objects.with_details(fields).order_by('-updated_at')  # Sort by updated_at in descending order
+    user_ids = params.getlist('user_id')
+
+    if user_ids:
+        for user_id in user_ids:
+            queryset = queryset.filter(participants__id=user_id)
+
+    return queryset.distinct()
+
+
 class ConversationListCreateView(generics.ListCreateAPIView):
     serializer_class = ConversationSerializer
 
     def get_queryset(self):
-        queryset = Conversation.objects.all().order_by('-updated_at')  # Sort by updated_at in descending order
-        user_ids = self.request.query_params.getlist('user_id')
-
-        if user_ids:
-            for user_id in user_ids:
-                queryset = queryset.filter(participants__id=user_id)
-
-        return queryset.distinct()
+        return filter_conversations(self.request.query_params, requested_fields(self.request))
 
 
 class ConversationDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Conversation.objects.all()
+    queryset = Conversation.objects.with_details()
     serializer_class = ConversationDetailSerializer
 
 
-class MessageListCreateView(generics.ListCreateAPIView):
-    queryset = Message.objects.all()
+class ConversationMessageListView(generics.ListAPIView):
+    throttle_scope = 'messages'
+    serializer_class = MessageSerializer
+
+    def get_queryset(self):
+        queryset = Message.objects.with_details().filter(conversation_id=self.kwargs['pk'])
+        after_id = self.request.query_params.get('after_id', None)
+        since = self.request.query_params.get('since', None)
+        before_id = self.request.query_params.get('before_id', None)
+        limit = self.get_int_param('limit', MESSAGES_PAGE_SIZE)
+        if limit < 1:
+            raise serializers.ValidationError({'limit': 'Ожидается число не меньше 1.'})
+        limit = min(limit, MESSAGES_MAX_PAGE_SIZE)
+
+        # Новые сообщения после известного клиенту id (для опроса передаются только изменения)
+        if after_id:
+            return queryset.filter(id__gt=self.get_int_param('after_id')).order_by('id')[:limit]
+
+        # Новые сообщения после момента времени
+        if since:
+            since_dt = parse_datetime(since)
+            if since_dt is None:
+                raise serializers.ValidationError({'since': 'Ожидается дата и время в формате ISO 8601.'})
+            return queryset.filter(sent_at__gt=since_dt).order_by('sent_at', 'id')[:limit]
+
+        # История: сообщения старше before_id, по умолчанию — самые новые
+        if before_id:
+            queryset = queryset.filter(id__lt=self.get_int_param('before_id'))
+        return queryset.newest(limit)
+
+    def get_int_param(self, name, default=None):
+        value = self.request.query_params.get(name, default)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise serializers.ValidationError({name: 'Ожидается целое число.'})
+
+
+class MessageListCreateView(ReadSerializerMixin, generics.ListCreateAPIView):
+    throttle_scope = 'messages'
+    queryset = Message.objects.with_details()
     serializer_class = MessageSerializer
+    read_serializer_class = MessageListReadSerializer
+    pagination_class = MessageCursorPagination
 
 
 class MessageDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Message.objects.all()
+    queryset = Message.objects.with_details()
     serializer_class = MessageSerializer
 
 
@@ -168,8 +332,10 @@ class ProductImageListCreateView(generics.ListCreateAPIView):
         product = Product.objects.get(id=product_id)
 
         # Проверяем, сколько изображений уже загружено для продукта
-        if product.images.count() >= 8:
-            raise serializers.ValidationError("Нельзя загрузить больше 8 изображений для одного продукта.")
+        if product.images.count() >= MAX_PRODUCT_IMAGES:
+            raise serializers.ValidationError(
+                f"Нельзя загрузить больше {MAX_PRODUCT_IMAGES} изображений для одного продукта."
+            )
 
         serializer.save(product=product)
 
@@ -178,17 +344,91 @@ class ProductImageUploadView(APIView):
         product = get_object_or_404(Product, id=product_id)
         images = request.FILES.getlist('images')
 
-        for image in images:
-            ProductImage.objects.create(product=product, image=image)
+        # Один COUNT на весь запрос: лишние файлы сверх лимита отклоняются
+        available = MAX_PRODUCT_IMAGES - product.images.count()
 
-        return Response({"success": True, "message": "Images uploaded successfully."})
+        results = []
+        accepted = []
+        for image in images:
+            result = {"name": image.name, "success": False}
+            results.append(result)
+            if len(accepted) >= available:
+                result["error"] = f"Нельзя загрузить больше {MAX_PRODUCT_IMAGES} изображений для одного продукта."
+                continue
+            try:
+                forms.ImageField().clean(image)
+            except ValidationError as error:
+                result["error"] = error.messages[0]
+                continue
+            accepted.append((image, result))
+
+        saved = []
+        for (image, result), name in zip(accepted, save_uploads([image for image, _ in accepted])):
+            if isinstance(name, Exception):
+                result["error"] = "Не удалось сохранить файл."
+            else:
+                saved.append((ProductImage(product=product, image=name), result))
+
+        # Все записи одним INSERT, задачи на производные — ещё одним; bulk_create не вызывает post_save
+        with transaction.atomic():
+            created = ProductImage.objects.bulk_create([product_image for product_image, _ in saved])
+            for product_image, (_, result) in zip(created, saved):
+                result.update({"id": product_image.pk, "success": True})
+            schedule_derivatives(*[product_image.pk for product_image in created])
+
+        uploaded = len(created)
+        return Response(
+            {"success": uploaded > 0, "message": f"Uploaded {uploaded} of {len(images)} images.", "results": results},
+            status=status.HTTP_200_OK if uploaded or not images else status.HTTP_400_BAD_REQUEST,
+        )
 
 
 class FavoritesListCreateView(generics.ListCreateAPIView):
+    filter_backends = (filters.DjangoFilterBackend,)
+    filterset_fields = ['user', 'product']
     queryset = Favorites.objects.all()
     serializer_class = FavoritesSerializer
 
 
+class FavoritesBulkView(APIView):
+    # Добавление и удаление избранного пачкой для пользователя из токена:
+    # {"add": [id товаров], "remove": [id товаров]}
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        serializer = FavoritesBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_id = request.user.id
+        add = set(serializer.validated_data['add'])
+        remove = set(serializer.validated_data['remove']) - add
+
+        with transaction.atomic():
+            # Только существующие товары, которых ещё нет в избранном
+            added = set(Product.objects.filter(id__in=add).exclude(
+                favorites__user_id=user_id,
+            ).values_list('id', flat=True)) if add else set()
+            Favorites.objects.bulk_create(
+                [Favorites(user_id=user_id, product_id=product_id) for product_id in added],
+                ignore_conflicts=True,
+            )
+            # bulk_create не вызывает post_save, удаление ниже счётчик уменьшит через сигнал
+            transaction.on_commit(lambda: record_favorites(added, 1))
+
+            favorites = Favorites.objects.filter(user_id=user_id, product_id__in=remove)
+            removed = set(favorites.values_list('product_id', flat=True)) if remove else set()
+            if removed:
+                favorites.delete()
+
+        return Response({'added': sorted(added), 'removed': sorted(removed)})
+
+
 class FavoritesDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Favorites.objects.all()
     serializer_class = FavoritesSerializer
+
+
+def media_blob(request, path):
+    # Содержимое blob-файла не меняется никогда, поэтому клиенты и CDN кэшируют его бессрочно
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
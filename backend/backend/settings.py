@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -50,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.routers.ReplicaPinningMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -71,17 +74,140 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
+
+
+# Channel layer для WebSocket-чата. По умолчанию в памяти процесса,
+# при нескольких воркерах нужен общий брокер (REDIS_URL)
+
+if os.environ.get('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.environ['REDIS_URL']]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
+    }
 
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# База выбирается переменными окружения: DB_ENGINE=postgres для PostgreSQL, иначе SQLite.
+# DB_POOL=pgbouncer — соединения идут через пул PgBouncer (transaction pooling),
+# поэтому Django не держит их сам и не использует серверные курсоры.
+# Сервер работает под ASGI, где синхронный код ORM каждого запроса может выполняться в новом потоке,
+# и постоянные соединения (CONN_MAX_AGE > 0) копились бы по потокам вместо переиспользования —
+# поэтому по умолчанию соединение закрывается после запроса, а переиспользование даёт PgBouncer.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+DB_POOL = os.environ.get('DB_POOL', '')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'hermes'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': 0 if DB_POOL == 'pgbouncer' else int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+            'CONN_HEALTH_CHECKS': True,
+            'DISABLE_SERVER_SIDE_CURSORS': DB_POOL == 'pgbouncer',
+        }
+    }
+    # Реплики только для чтения: DB_REPLICA_HOSTS=replica1,replica2
+    for number, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), start=1):
+        DATABASES[f'replica{number}'] = dict(DATABASES['default'], HOST=host.strip(), TEST={'MIRROR': 'default'})
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Сколько секунд ждать освобождения блокировки записи вместо "database is locked"
+                'timeout': int(os.environ.get('DB_BUSY_TIMEOUT', 20)),
+            },
+        }
     }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['app.routers.PrimaryReplicaRouter']
+# Сколько секунд после записи клиент читает из основной базы
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# Справочники (категории, регионы) кэшируются в памяти процесса, при REDIS_URL — в общем Redis
+# (нужен пакет redis)
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Закрепление клиента за основной базой после записи (REPLICA_PIN_SECONDS) хранится в кэше:
+# с кэшем в памяти процесса GET в другом воркере читал бы реплику и не видел только что сделанную запись
+if DATABASE_REPLICAS and not os.environ.get('REDIS_URL'):
+    raise ImproperlyConfigured('Реплики (DB_REPLICA_HOSTS) требуют общего кэша: задайте REDIS_URL')
+
+# Сброс кэша справочников при изменении доходит только до процесса, сделавшего запись,
+# поэтому без общего Redis остальные воркеры gunicorn отдают старые данные не дольше минуты
+REFERENCE_CACHE_TIMEOUT = 60 * 60 * 24 if os.environ.get('REDIS_URL') else 60
+# Сколько секунд хранится количество товаров для набора фильтров (сбрасывается при изменении товаров)
+PRODUCT_COUNT_TIMEOUT = 60
+# Границы диапазонов цены для /api/products/facets/ (после изменения — manage.py rebuild_facet_counts)
+PRODUCT_PRICE_BUCKETS = (0, 50, 100, 500, 1000, 5000)
+
+# Буфер счётчиков товаров (просмотры, избранное): запись в базу при таком числе
+# изменённых счётчиков или раз в столько секунд
+COUNTER_FLUSH_SIZE = 500
+COUNTER_FLUSH_INTERVAL = 10
+
+# Лента «рядом» (?near_district=): размер ячейки сетки районов в градусах, дальше какого расстояния
+# районы не считаются соседними и условное расстояние до районов того же региона без координат.
+# После изменения — manage.py rebuild_district_distances
+GEO_CELL_DEGREES = 0.5
+NEARBY_MAX_DISTANCE_KM = 300
+NEARBY_REGION_DISTANCE_KM = 150
+
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': ['app.authentication.SignedTokenAuthentication'],
+    'DEFAULT_THROTTLE_CLASSES': ['app.throttling.SlidingWindowThrottle'],
+    # Сколько прокси перед приложением добавляют X-Forwarded-For (для определения IP клиента)
+    'NUM_PROXIES': int(os.environ['NUM_PROXIES']) if os.environ.get('NUM_PROXIES') else None,
 }
+# Лимиты запросов по throttle_scope представления: 'user' — для запросов с токеном, 'ip' — для анонимных.
+# None — без ограничения. Счётчики в памяти процесса, при REDIS_URL — общие для всех воркеров
+THROTTLE_RATES = {
+    'default': {'user': '600/min', 'ip': '300/min'},
+    'products': {'user': '300/min', 'ip': '300/min'},
+    'messages': {'user': '120/min', 'ip': '60/min'},
+    'login': {'user': '10/min', 'ip': '10/min'},
+}
+THROTTLE_STORE = 'app.throttling.CacheThrottleStore' if os.environ.get('REDIS_URL') \
+    else 'app.throttling.MemoryThrottleStore'
+
+# Срок жизни токена из /api/auth/login/ в секундах; токен проверяется по подписи без запроса к базе
+AUTH_TOKEN_MAX_AGE = int(os.environ.get('AUTH_TOKEN_MAX_AGE', 60 * 60 * 24 * 14))
 
 
 # Password validation
@@ -129,3 +255,31 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Загрузки хранятся по хэшу содержимого (app/storage.py), одинаковые файлы — один раз
+STORAGES = {
+    'default': {
+        'BACKEND': 'app.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Производные изображений товаров (WebP разной ширины), генерируются воркером очереди задач
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 1280)
+# Через сколько секунд после удаления последней ссылки воркер удаляет blob-файл
+# (и сколько файл не трогается после повторной загрузки того же содержимого)
+BLOB_DELETE_GRACE = 10 * 60
+
+# Очередь фоновых задач в таблице app_task (manage.py run_tasks): число процессов воркера,
+# попытки с экспоненциальной задержкой и сколько секунд задача закреплена за воркером
+TASK_WORKERS = int(os.environ.get('TASK_WORKERS', 2))
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_BACKOFF = 10
+TASK_RETRY_MAX_DELAY = 60 * 60
+TASK_LEASE_SECONDS = 5 * 60
+TASK_POLL_INTERVAL = 1
+# Сколько хранить выполненные/упавшие задачи и как часто воркер их удаляет
+TASK_RETENTION = 7 * 24 * 60 * 60
+TASK_PRUNE_INTERVAL = 60 * 60
@@ -15,15 +15,22 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from app.views import media_blob
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('app.urls')),
 ]
 
+# Медиафайлы Django отдаёт только при разработке. В продакшене MEDIA_URL раздаёт веб-сервер или CDN,
+# и для blobs/ он должен ставить те же заголовки, что media_blob: Cache-Control: public, max-age=31536000, immutable
 if settings.DEBUG:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>blobs/.+)$' % settings.MEDIA_URL.lstrip('/'), media_blob, name='media-blob'),
+    ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
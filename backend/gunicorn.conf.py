@@ -0,0 +1,27 @@
+# Конфигурация gunicorn для ASGI (backend.asgi:application) с воркерами uvicorn.
+# Каждый воркер — цикл событий, который держит тысячи медленных соединений,
+# поэтому воркеров нужно примерно по числу ядер, а не по числу одновременных клиентов.
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8005')
+worker_class = 'uvicorn.workers.UvicornWorker'
+# Без REDIS_URL channel layer WebSocket-чата в памяти процесса: сообщение, созданное в одном воркере,
+# не дошло бы до сокетов другого, поэтому по умолчанию тогда работает один воркер
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() if os.environ.get('REDIS_URL') else 1))
+
+# Медленные мобильные клиенты не занимают воркер, но долгие запросы всё равно ограничиваем
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 75
+
+# Периодический перезапуск воркеров от утечек памяти, со сдвигом, чтобы не перезапускались все сразу
+max_requests = 10000
+max_requests_jitter = 1000
+
+
+def worker_exit(server, worker):
+    # Несохранённые приращения счётчиков товаров (app/counters.py) записываются перед остановкой воркера
+    from app.counters import counter_buffer
+
+    counter_buffer.flush()